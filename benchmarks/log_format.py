@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the log formatters in project/log.py.
+
+Compares ExtraFormatter with its previous implementation (kept below as
+LegacyExtraFormatter) and JsonLineFormatter with jsonformatter's
+JsonFormatter, which the "json" formatter used before. JsonLineFormatter
+runs once with the json module and once with orjson, if it's installed.
+Before timing, the outputs are checked to match the reference.
+jsonformatter is in benchmarks/requirements.txt.
+
+  pip install -r benchmarks/requirements.txt
+  python benchmarks/log_format.py
+  python benchmarks/log_format.py --records 100000
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+project_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project")
+sys.path.insert(0, project_dir)
+import log  # noqa: E402
+
+try:
+    from jsonformatter import JsonFormatter
+except ImportError:
+    sys.exit(
+        "jsonformatter is required as reference of the json formatter, "
+        "pip install -r benchmarks/requirements.txt"
+    )
+
+
+class LegacyExtraFormatter(logging.Formatter):
+    dummy = logging.LogRecord(None, None, None, None, None, None, None)
+    ignored_extras = [
+        "args",
+        "asctime",
+        "created",
+        "exc_info",
+        "filename",
+        "funcName",
+        "levelname",
+        "levelno",
+        "lineno",
+        "message",
+        "module",
+        "msecs",
+        "msg",
+        "name",
+        "pathname",
+        "process",
+        "processName",
+        "relativeCreated",
+        "stack_info",
+        "thread",
+        "threadName",
+    ]
+
+    def format(self, record):
+        extra_txt = ""
+        for k, v in record.__dict__.items():
+            if k not in self.dummy.__dict__ and k not in self.ignored_extras:
+                extra_txt += " --- {}={}".format(k, v)
+        message = super().format(record)
+        return message + extra_txt
+
+
+def make_records(count: int) -> list:
+    """A mix of the records the API logs: plain messages, messages with
+    the extras of a mount and subprocess output lines."""
+    logger = logging.getLogger("benchmark")
+    records = []
+    for i in range(count):
+        if i % 3 == 0:
+            extra = {}
+            msg, args = "Mount %s ready", (f"path{i}",)
+        elif i % 3 == 1:
+            extra = {"path": f"path{i}", "template": "rclone", "backend": "s3"}
+            msg, args = "Mount started", ()
+        else:
+            extra = {"path": f"path{i}", "stream": "stderr"}
+            msg, args = "NOTICE: vfs cache: cleaned: objects 0 (was 0)", ()
+        records.append(
+            logger.makeRecord(
+                "benchmark", 20, __file__, i, msg, args, None, "mount", extra
+            )
+        )
+    return records
+
+
+def copy(record: logging.LogRecord) -> logging.LogRecord:
+    # Formatters set attributes on the record, each run gets fresh ones
+    return logging.makeLogRecord(dict(record.__dict__))
+
+
+def bench(formatter: logging.Formatter, records: list, rounds: int) -> float:
+    """Best time per record in microseconds."""
+    best = None
+    for _ in range(rounds):
+        batch = [copy(record) for record in records]
+        start = time.perf_counter()
+        for record in batch:
+            formatter.format(record)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(records) * 1e6
+
+
+def check(name: str, formatter, reference, records: list, parse=None):
+    for record in records[:30]:
+        expected = reference.format(copy(record))
+        output = formatter.format(copy(record))
+        if parse:
+            expected, output = parse(expected), parse(output)
+        if expected != output:
+            sys.exit(f"{name}: output differs\n  {expected}\n  {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    simple = log.supported_formatter_kwargs["simple"]
+    json_kwargs = log.supported_formatter_kwargs["json"]
+    legacy = LegacyExtraFormatter(**simple)
+    # name, formatter, JSON encoder, reference
+    cases = [
+        ("simple/legacy", legacy, None, None),
+        ("simple/ExtraFormatter", log.ExtraFormatter(**simple), None, legacy),
+    ]
+    reference = JsonFormatter(**json_kwargs, mix_extra=True)
+    cases.append(("json/jsonformatter", reference, None, None))
+    cases.append(
+        (
+            "json/JsonLineFormatter",
+            log.JsonLineFormatter(**json_kwargs),
+            None,
+            reference,
+        )
+    )
+    orjson = log.orjson
+    if orjson is not None:
+        cases.append(
+            (
+                "json/JsonLineFormatter+orjson",
+                log.JsonLineFormatter(**json_kwargs),
+                orjson,
+                reference,
+            )
+        )
+
+    print(f"{'formatter':<32}{'us/record':>12}")
+    for name, formatter, encoder, reference in cases:
+        log.orjson = encoder
+        if reference is not None:
+            parse = json.loads if name.startswith("json") else None
+            check(name, formatter, reference, records, parse)
+        print(f"{name:<32}{bench(formatter, records, args.rounds):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""Load tests of the API against fake mount backends.
+
+Every backend runs in its own child process with a fresh temporary
+directory for mountpoints, configs and the fake mount table, and the
+stand-in executables of tests/fake_backend.py in front of PATH. With one
+worker the app is driven in-process through httpx's ASGI transport,
+which also allows to measure the event loop lag while the scenarios run.
+With --workers > 1 it's served by gunicorn (gunicorn_http.py with a
+shared registry) and driven over HTTP.
+
+Scenarios, run in this order against the same instance:
+  mount    --mounts mounts to distinct paths, --concurrency at a time
+  list     --mounts GET / requests with all mounts active
+  unmount  DELETE of all mounts
+  churn    every client mounts, lists and unmounts its own path
+
+  python benchmarks/run.py
+  python benchmarks/run.py --backends rclone,nfs --mounts 200 --workers 4
+  python benchmarks/run.py --fake FAKE_STARTUP_DELAY=0.5 --log json
+  python benchmarks/run.py --save-baseline
+
+Results are compared with baselines.json, a slower p95 or lower
+throughput than the tolerance allows is reported as regression and
+fails the run. Baselines depend on the machine, record your own with
+--save-baseline before comparing changes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+here = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(here)
+project_dir = os.path.join(repo_dir, "project")
+fake_backend_path = os.path.join(repo_dir, "tests", "fake_backend.py")
+baselines_path = os.path.join(here, "baselines.json")
+fake_commands = ["rclone", "umount", "mount.nfs4", "unicore-fusedriver"]
+scenarios = ["mount", "list", "unmount", "churn"]
+# Compared with the baseline
+watched = {"p95": "max", "throughput": "min"}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def mount_body(backend: str, path: str, auth_url: str) -> dict:
+    options = {"displayName": path, "template": backend, "config": {}}
+    if backend in ["rclone", "rcd"]:
+        options["template"] = "s3"
+        options["config"] = {
+            "type": "s3",
+            "provider": "Other",
+            "remotepath": "bucket",
+            "access_key_id": "benchmark",
+            "obscure_secret_access_key": "benchmark",
+        }
+    elif backend == "nfs":
+        options["config"] = {"server": "127.0.0.1", "remotepath": "/export"}
+    elif backend == "uftp":
+        options["config"] = {
+            "access_token": "benchmark",
+            "auth_url": auth_url,
+            "remotepath": "/home",
+        }
+    return {"path": path, "options": options}
+
+
+def start_auth_server(delay: float) -> str:
+    """Stub of the UNICORE authentication server."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+            data = json.dumps(
+                {"serverHost": "127.0.0.1", "serverPort": 64434, "secret": "x"}
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/rest/auth/UFTP"
+
+
+class LagMonitor:
+    """Samples how late the event loop wakes up a sleeping task."""
+
+    interval = 0.005
+
+    def __init__(self):
+        self.samples = []
+        self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(loop.time() - start - self.interval)
+
+    def start(self):
+        self.samples = []
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> list:
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        return self.samples
+
+
+async def timed(latencies: list, errors: list, request, expected: tuple):
+    start = time.perf_counter()
+    try:
+        response = await request()
+        if response.status_code not in expected:
+            errors.append(f"{response.status_code} {response.text[:200]}")
+    except Exception as e:
+        errors.append(repr(e))
+    latencies.append(time.perf_counter() - start)
+
+
+async def run_scenario(name: str, client, args, lag: LagMonitor) -> dict:
+    latencies = []
+    errors = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    paths = [f"bench-{i}" for i in range(args.mounts)]
+
+    async def limited(request, expected):
+        async with semaphore:
+            await timed(latencies, errors, request, expected)
+
+    def post(path):
+        body = mount_body(args.backend, path, args.auth_url)
+        return lambda: client.post("/", json=body)
+
+    async def churn(i):
+        path = f"churn-{i}"
+        body = mount_body(args.backend, path, args.auth_url)
+        for _ in range(max(1, args.mounts // args.concurrency)):
+            await timed(latencies, errors, lambda: client.post("/", json=body), (204,))
+            await timed(latencies, errors, lambda: client.get("/"), (200,))
+            await timed(latencies, errors, lambda: client.delete(f"/{path}"), (204,))
+
+    if lag:
+        lag.start()
+    start = time.perf_counter()
+    if name == "mount":
+        calls = [limited(post(path), (204,)) for path in paths]
+    elif name == "list":
+        calls = [limited(lambda: client.get("/"), (200,)) for _ in paths]
+    elif name == "unmount":
+        calls = [
+            limited(lambda path=path: client.delete(f"/{path}"), (204,))
+            for path in paths
+        ]
+    else:
+        calls = [churn(i) for i in range(args.concurrency)]
+    await asyncio.gather(*calls)
+    duration = time.perf_counter() - start
+    lag_samples = await lag.stop() if lag else []
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "first_errors": errors[:3],
+        "duration": round(duration, 3),
+        "throughput": round(len(latencies) / duration, 1),
+        "p50": ms(percentile(latencies, 0.5)),
+        "p95": ms(percentile(latencies, 0.95)),
+        "p99": ms(percentile(latencies, 0.99)),
+        "loop_lag_p99": ms(percentile(lag_samples, 0.99)),
+        "loop_lag_max": ms(max(lag_samples) if lag_samples else None),
+    }
+
+
+async def run_in_process(args) -> dict:
+    import httpx
+
+    sys.path.insert(0, project_dir)
+    import main
+
+    results = {}
+    lag = LagMonitor()
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=120
+        ) as client:
+            for name in scenarios:
+                results[name] = await run_scenario(name, client, args, lag)
+    return results
+
+
+async def run_gunicorn(args, env: dict) -> dict:
+    import httpx
+
+    port = free_port()
+    pidfile = os.path.join(args.tmp, "gunicorn.pid")
+    # Command line settings override the ones of the config file
+    server = subprocess.Popen(
+        [
+            "gunicorn",
+            "-c",
+            os.path.join(repo_dir, "gunicorn_http.py"),
+            "-b",
+            f"127.0.0.1:{port}",
+            "--pid",
+            pidfile,
+            "--user",
+            str(os.getuid()),
+            "--group",
+            str(os.getgid()),
+            "--access-logfile",
+            os.devnull,
+            "main:app",
+        ],
+        cwd=project_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=open(os.path.join(args.tmp, "gunicorn.log"), "w"),
+    )
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits
+        ) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    if (await client.get("/ready")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError("gunicorn did not start, see gunicorn.log")
+                await asyncio.sleep(0.1)
+            for name in scenarios:
+                results[name] = await run_scenario(name, client, args, None)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+    return results
+
+
+def child(args):
+    env = dict(os.environ)
+    if args.backend == "uftp":
+        args.auth_url = start_auth_server(float(env.get("FAKE_AUTH_DELAY", 0.05)))
+    else:
+        args.auth_url = None
+    if args.workers > 1:
+        results = asyncio.run(run_gunicorn(args, env))
+    else:
+        results = asyncio.run(run_in_process(args))
+    print(json.dumps(results))
+
+
+def logging_config(mode: str, tmp: str) -> dict:
+    config = {"stream": {"enabled": False}, "file": {"enabled": False}}
+    if mode != "off":
+        config["file"] = {
+            "enabled": True,
+            "level": "DEBUG",
+            "formatter": "json" if mode == "json" else "simple",
+            "filename": os.path.join(tmp, "benchmark.log"),
+        }
+    return config
+
+
+def run_backend(backend: str, args) -> dict:
+    """Runs all scenarios of a backend in a child process."""
+    with tempfile.TemporaryDirectory(prefix="datamount-bench-") as tmp:
+        bin_dir = os.path.join(tmp, "bin")
+        os.makedirs(bin_dir)
+        for command in fake_commands:
+            os.symlink(fake_backend_path, os.path.join(bin_dir, command))
+        open(os.path.join(tmp, "mountinfo"), "w").close()
+        with open(os.path.join(tmp, "logging.json"), "w") as f:
+            json.dump(logging_config(args.log, tmp), f)
+        env = {
+            **os.environ,
+            "PATH": f"{bin_dir}:{os.environ.get('PATH', '')}",
+            "PYTHONPATH": project_dir,
+            "BASE_DIR": os.path.join(tmp, "mounts"),
+            "MOUNTINFO_FILE": os.path.join(tmp, "mountinfo"),
+            "RCLONE_CONFIG_DIR": os.path.join(tmp, "config"),
+            "LOGGING_CONFIG_FILE": os.path.join(tmp, "logging.json"),
+            "INIT_MOUNTS": os.path.join(tmp, "mounts.json"),
+            "VFS_CACHE_DIR": os.path.join(tmp, "vfs"),
+            "UFTP_FUSEDRIVER": os.path.join(bin_dir, "unicore-fusedriver"),
+            "NFS_ENABLED": "true",
+            "TRACING_FILE": os.path.join(tmp, "traces.jsonl"),
+        }
+        if backend == "rcd":
+            env["RCLONE_BACKEND"] = "rcd"
+            env["RCLONE_RC_ADDR"] = f"127.0.0.1:{free_port()}"
+        if args.workers > 1:
+            env["SHARED_REGISTRY"] = "true"
+            env["GUNICORN_WORKERS"] = str(args.workers)
+        for setting in args.fake:
+            key, _, value = setting.partition("=")
+            env[key] = value
+        os.makedirs(env["BASE_DIR"])
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--child",
+            "--backend",
+            backend,
+            "--tmp",
+            tmp,
+            "--mounts",
+            str(args.mounts),
+            "--concurrency",
+            str(args.concurrency),
+            "--workers",
+            str(args.workers),
+        ]
+        result = subprocess.run(
+            command, env=env, cwd=project_dir, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"{backend} failed:\n{result.stderr[-3000:]}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(key: str, result: dict, baselines: dict, tolerance: float) -> list:
+    baseline = baselines.get(key, None)
+    if not baseline:
+        return []
+    regressions = []
+    for metric, direction in watched.items():
+        old, new = baseline.get(metric, None), result.get(metric, None)
+        if old is None or new is None:
+            continue
+        if direction == "max" and new > old * (1 + tolerance):
+            regressions.append(f"{key} {metric} {old} -> {new}")
+        elif direction == "min" and new < old * (1 - tolerance):
+            regressions.append(f"{key} {metric} {old} -> {new}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--backends", default="rclone,rcd,nfs,uftp")
+    parser.add_argument("--mounts", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--fake",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Settings of the fake backends (FAKE_*) or the API",
+    )
+    parser.add_argument("--log", choices=["off", "file", "json"], default="off")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--tmp", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    baselines = {}
+    if os.path.exists(baselines_path):
+        with open(baselines_path) as f:
+            baselines = json.load(f)
+    columns = ["requests", "errors", "throughput", "p50", "p95", "p99"]
+    columns += ["loop_lag_p99", "loop_lag_max"]
+    print(f"{'scenario':<28}" + "".join(f"{c:>14}" for c in columns))
+    regressions = []
+    failed = False
+    for backend in args.backends.split(","):
+        if backend == "rcd" and args.workers > 1:
+            print(f"{backend}: skipped, rcd can't run with several workers")
+            continue
+        try:
+            results = run_backend(backend, args)
+        except RuntimeError as e:
+            print(e)
+            failed = True
+            continue
+        for name, result in results.items():
+            key = f"{backend}/{args.workers}w/{name}"
+            values = "".join(f"{str(result[c]):>14}" for c in columns)
+            print(f"{key:<28}{values}")
+            for error in result["first_errors"]:
+                print(f"  error: {error}")
+            if args.save_baseline:
+                baselines[key] = {metric: result[metric] for metric in watched}
+            else:
+                regressions += compare(key, result, baselines, args.tolerance)
+    if args.save_baseline:
+        with open(baselines_path, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines saved to {baselines_path}")
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if regressions or failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -69,7 +69,8 @@ preload_app = True
 #       A positive integer. Generally set in the 1-5 seconds range.
 #
 
-workers = 1
+# More than one worker requires SHARED_REGISTRY=true, see project/registry.py
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
 threads = 5
 
 worker_class = "uvicorn.workers.UvicornWorker"
@@ -185,6 +186,20 @@ access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
 #       A callable that takes a server instance as the sole argument.
 #
 
+
+def on_exit(server):
+    # Workers keep their mounts for each other with a shared registry,
+    # the last one standing can't tell a restart from a shutdown
+    import asyncio
+
+    import journal
+    import utils
+    from values import shared_registry
+
+    if shared_registry and not journal.enabled():
+        asyncio.run(utils.release_registry())
+
+
 # Max Requests used to reduce memory consumption
 max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
 max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 0))
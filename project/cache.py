@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Small LRU cache whose entries expire after a time to live.
+
+    Not thread safe, meant to be used from the event loop only.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return default
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.entries[key]
+            return default
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        self.entries[key] = (value, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,26 @@
+import hashlib
+import os
+
+from values import config_store_dir
+
+
+def location(path: str) -> str:
+    name = hashlib.sha256(path.encode()).hexdigest()[:16]
+    return os.path.join(config_store_dir, f"{name}.conf")
+
+
+def write(path: str, content: str) -> str:
+    """Stores the rclone config of a mount, readable by the owner only."""
+    os.makedirs(config_store_dir, mode=0o700, exist_ok=True)
+    config_path = location(path)
+    fd = os.open(config_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    return config_path
+
+
+def remove(path: str):
+    try:
+        os.remove(location(path))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,181 @@
+"""Reloads logging.json and mounts.json when they change.
+
+The directories of the files are watched with inotify, so files that
+are replaced by a rename (editors, Kubernetes ConfigMap updates) are
+noticed as well. A directory that doesn't exist yet is watched through
+its nearest existing parent until it's created. Without inotify the
+files are polled. Changes are recognized by their content, after the
+events settled for debounce seconds.
+"""
+import asyncio
+import ctypes.util
+import os
+
+import utils
+from log import createLogger
+from log import getLogger
+from values import config_watch
+from values import init_mounts_path
+from values import logging_config_path
+
+# Used when inotify is not available
+poll_interval = 2
+debounce = 0.5
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+watch_mask = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+
+watch_task = None
+
+
+class Inotify:
+    """Directory watches of an inotify instance. changed is set by any
+    event, which is all the watcher needs to know."""
+
+    def __init__(self, directories: list):
+        self.directories = directories
+        self.fd = None
+        self.changed = asyncio.Event()
+
+    def open(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        try:
+            for directory in self.directories:
+                if libc.inotify_add_watch(fd, directory.encode(), watch_mask) < 0:
+                    raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+            asyncio.get_running_loop().add_reader(fd, self._on_event)
+        except:
+            os.close(fd)
+            raise
+        self.fd = fd
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+
+    def _on_event(self):
+        try:
+            # Drains all pending events
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        self.changed.set()
+
+    async def wait(self):
+        await self.changed.wait()
+        self.changed.clear()
+
+
+def read(path: str):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+async def reload_logging():
+    # Waits for the listener thread to handle the queued records, that
+    # may take a while with a slow handler
+    await asyncio.to_thread(createLogger)
+    getLogger().info("Logging configuration reloaded")
+
+
+# file -> reload function
+reloads = {
+    logging_config_path: reload_logging,
+    init_mounts_path: utils.reload_init_mounts,
+}
+
+
+async def apply(path: str):
+    log = getLogger()
+    try:
+        result = reloads[path]()
+        if asyncio.iscoroutine(result):
+            await result
+    except:
+        log.exception(f"Reload of {path} failed")
+
+
+def watched_directory(path: str) -> str:
+    """Directory of a file, or its nearest existing parent."""
+    directory = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(directory):
+        directory = os.path.dirname(directory)
+    return directory
+
+
+def watched_directories() -> list:
+    return sorted({watched_directory(path) for path in reloads})
+
+
+def open_inotify(directories: list):
+    inotify = Inotify(directories)
+    try:
+        inotify.open()
+    except (AttributeError, OSError):
+        getLogger().warning("inotify not available, polling config files")
+        return None
+    return inotify
+
+
+async def watch():
+    log = getLogger()
+    contents = {path: read(path) for path in reloads}
+    for path in reloads:
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            log.warning(
+                f"{directory} does not exist, watching {watched_directory(path)} "
+                "until it's created"
+            )
+    inotify = open_inotify(watched_directories())
+    try:
+        while True:
+            if inotify:
+                await inotify.wait()
+                # An editor or kubelet writes in several steps
+                await asyncio.sleep(debounce)
+                inotify.changed.clear()
+                directories = watched_directories()
+                if directories != inotify.directories:
+                    # A missing directory was created, or one was removed
+                    inotify.close()
+                    inotify = open_inotify(directories)
+            else:
+                await asyncio.sleep(poll_interval)
+            for path in reloads:
+                content = read(path)
+                if content != contents[path]:
+                    contents[path] = content
+                    log.info(f"{path} changed, reload")
+                    await apply(path)
+    finally:
+        if inotify:
+            inotify.close()
+
+
+def start():
+    global watch_task
+    if config_watch:
+        watch_task = asyncio.create_task(watch())
+
+
+async def stop():
+    if watch_task:
+        watch_task.cancel()
+        await asyncio.gather(watch_task, return_exceptions=True)
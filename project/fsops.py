@@ -0,0 +1,152 @@
+"""Filesystem calls on mountpoints, off the event loop.
+
+A call on a hung FUSE or NFS mount blocks in uninterruptible sleep and
+never returns. Calls run in a bounded pool of daemon threads and are
+awaited with a timeout. A mountpoint whose call timed out is quarantined
+until that call returns, later calls fail right away instead of piling
+up more stuck threads. The stuck thread leaves the pool, a new one
+takes its place.
+"""
+import asyncio
+import concurrent.futures
+import errno
+import os
+import queue
+import threading
+
+from values import fs_ops_threads
+from values import fs_ops_timeout
+from values import gid
+from values import uid
+
+# mountpoint -> the call that's stuck on it
+quarantined = {}
+
+
+class MountpointHung(OSError):
+    def __init__(self, fullpath: str, message: str):
+        super().__init__(errno.ETIMEDOUT, message, fullpath)
+
+
+class Pool:
+    """Daemon worker threads, started on demand up to size. Unlike
+    ThreadPoolExecutor's workers, stuck ones don't block the exit of
+    the interpreter."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.calls = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.threads = 0
+        self.idle = 0
+        self.started = 0
+        # Calls whose thread left the pool, see detach
+        self.detached = set()
+
+    def _start_thread(self):
+        self.threads += 1
+        self.idle += 1
+        self.started += 1
+        threading.Thread(
+            target=self._work, name=f"fsops-{self.started}", daemon=True
+        ).start()
+
+    def submit(self, fn, *args) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.idle == 0 and self.threads < self.size:
+                self._start_thread()
+        self.calls.put((future, fn, args))
+        return future
+
+    def detach(self, future: concurrent.futures.Future):
+        """Stops counting the thread stuck in the call of future against
+        size, it exits once the call returns. Starts a new thread if
+        calls are waiting."""
+        with self.lock:
+            if future.done():
+                return
+            self.detached.add(future)
+            self.threads -= 1
+            if self.idle == 0 and not self.calls.empty():
+                self._start_thread()
+
+    def _work(self):
+        while True:
+            future, fn, args = self.calls.get()
+            with self.lock:
+                self.idle -= 1
+            # False if it was cancelled while queued
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self.lock:
+                if future in self.detached:
+                    self.detached.discard(future)
+                    return
+                self.idle += 1
+
+
+pool = Pool(fs_ops_threads)
+
+
+def lift(fullpath: str, future: concurrent.futures.Future):
+    if quarantined.get(fullpath, None) is future:
+        del quarantined[fullpath]
+
+
+async def run(fullpath: str, fn, *args, timeout: float = None):
+    """Runs fn(*args), a call touching the mountpoint fullpath, in the
+    pool. Raises MountpointHung on timeout or if the mountpoint is
+    quarantined. Cancelling the caller cancels a call that hasn't started
+    yet."""
+    if timeout is None:
+        timeout = fs_ops_timeout
+    fullpath = os.path.normpath(fullpath)
+    if fullpath in quarantined:
+        raise MountpointHung(fullpath, "Mountpoint quarantined, it hung before")
+    future = pool.submit(fn, *args)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        # Cancelled by wait_for if it was still queued, else it's stuck
+        if future.cancelled():
+            raise MountpointHung(fullpath, f"No free thread within {timeout}s")
+        quarantined[fullpath] = future
+        future.add_done_callback(lambda _: lift(fullpath, future))
+        pool.detach(future)
+        raise MountpointHung(fullpath, f"Mountpoint not responding after {timeout}s")
+
+
+def release(fullpath: str):
+    """Ends the quarantine of a mountpoint, e.g. after it was unmounted."""
+    quarantined.pop(os.path.normpath(fullpath), None)
+
+
+def _prepare_mountpoint(fullpath: str, path: str):
+    if not os.path.exists(fullpath):
+        os.makedirs(fullpath, exist_ok=True)
+        os.chown(fullpath, uid, gid)
+    if os.path.isdir(fullpath):
+        if os.listdir(fullpath):
+            raise Exception(f"Directory {path} is not empty.")
+
+
+async def prepare_mountpoint(fullpath: str, path: str):
+    """Creates the mountpoint, which must be empty. path is the one
+    reported in the error."""
+    await run(fullpath, _prepare_mountpoint, fullpath, path)
+
+
+def _is_usable(fullpath: str) -> bool:
+    return os.path.isdir(fullpath) and os.listdir(fullpath) is not None
+
+
+async def is_usable(fullpath: str, timeout: float = None) -> bool:
+    return await run(fullpath, _is_usable, fullpath, timeout=timeout)
+
+
+async def rmdir(fullpath: str):
+    await run(fullpath, os.rmdir, fullpath)
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import fsops
+import mountinfo
+import utils
+from log import getLogger
+from models import DataMountModel
+from values import base_mount_dir
+from values import health_dead_after
+from values import health_degraded_latency
+from values import health_interval
+from values import health_probe_timeout
+from values import health_remount
+from values import health_remount_backoff
+from values import health_remount_max_attempts
+from values import health_remount_max_backoff
+from values import mount_ready_timeout
+from values import shared_registry
+
+latency_samples = 100
+
+# path -> probe state, see new_state
+states = {}
+remount_tasks = {}
+monitor_task = None
+
+
+def new_state() -> dict:
+    return {
+        "status": "unknown",
+        "failures": 0,
+        "last_probe": None,
+        "last_error": None,
+        "latencies": deque(maxlen=latency_samples),
+        # Stored model while a remount is due, also when the path is
+        # not mounted anymore because a remount attempt failed
+        "pending": None,
+        "remount_attempts": 0,
+        "next_remount": 0.0,
+        "remounts": 0,
+    }
+
+
+def _probe(fullpath: str) -> float:
+    start = time.monotonic()
+    os.stat(fullpath)
+    with os.scandir(fullpath) as entries:
+        next(entries, None)
+    return time.monotonic() - start
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def set_status(path: str, state: dict, status: str):
+    if state["status"] != status:
+        log_method = getLogger().info if status == "healthy" else getLogger().warning
+        log_method(
+            f"Mount {path} is {status}",
+            extra={"previous": state["status"], "error": state["last_error"]},
+        )
+    state["status"] = status
+
+
+async def probe(path: str, mountpoints: set = None):
+    state = states.setdefault(path, new_state())
+    fullpath = os.path.join(base_mount_dir, path)
+    state["last_probe"] = time.time()
+    try:
+        if mountpoints is not None and os.path.normpath(fullpath) not in mountpoints:
+            raise Exception("not mounted")
+        # A hung mount is quarantined by fsops, it's not probed again
+        # while its last probe is still stuck
+        latency = await fsops.run(
+            fullpath, _probe, fullpath, timeout=health_probe_timeout
+        )
+    except Exception as e:
+        if isinstance(e, fsops.MountpointHung):
+            state["last_error"] = f"probe failed: {e.strerror}"
+        else:
+            state["last_error"] = repr(e)
+        state["failures"] += 1
+        if state["failures"] >= health_dead_after:
+            set_status(path, state, "dead")
+        else:
+            set_status(path, state, "degraded")
+        return
+    state["latencies"].append(latency)
+    state["failures"] = 0
+    state["last_error"] = None
+    state["remount_attempts"] = 0
+    if latency > health_degraded_latency:
+        set_status(path, state, "degraded")
+    else:
+        set_status(path, state, "healthy")
+
+
+async def remount(path: str, model: dict):
+    """Unmounts a dead mount and mounts it again with its stored model."""
+    log = getLogger()
+    state = states[path]
+    # Set if a previous attempt failed and left the path unmounted
+    retry = state["pending"] is not None
+    state["pending"] = model
+    state["remount_attempts"] += 1
+    backoff = health_remount_backoff * 2 ** (state["remount_attempts"] - 1)
+    state["next_remount"] = time.monotonic() + min(backoff, health_remount_max_backoff)
+    log.info(f"Remount {path} (attempt {state['remount_attempts']}) ...")
+    async with utils.get_path_lock(path):
+        entry = utils.get_mounts().get(path, None)
+        if entry is None and not retry:
+            # Unmounted in the meantime
+            state["pending"] = None
+            return
+        if entry:
+            if entry["model"] != model:
+                # Replaced by a new mount in the meantime
+                state["pending"] = None
+                return
+            try:
+                await utils.unmount(path, force=True)
+            except:
+                log.exception(f"Remount {path}: unmount failed")
+            # Wait until the old mount left the registry
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(entry["task"]), mount_ready_timeout
+                )
+            except asyncio.TimeoutError:
+                log.warning(f"Remount {path} ... failed. Old mount still running")
+                return
+        try:
+            success, error_process = await utils.mount(DataMountModel(**model))
+        except Exception as e:
+            success, error_process = False, repr(e)
+            try:
+                await utils.unmount(path, force=True)
+            except:
+                pass
+    if not success:
+        log.warning(f"Remount {path} ... failed. Error: {error_process}")
+        if state["remount_attempts"] >= health_remount_max_attempts:
+            log.error(f"Remount {path} ... giving up")
+            states.pop(path, None)
+        return
+    log.info(f"Remount {path} ... successful")
+    state["pending"] = None
+    state["failures"] = 0
+    state["remounts"] += 1
+    state["status"] = "unknown"
+
+
+async def check_all():
+    if shared_registry:
+        # Mounts of workers that died since are probed from now on
+        await utils.adopt_orphans()
+    async with utils.get_lock():
+        models = {path: entry["model"] for path, entry in utils.get_mounts().items()}
+    for path in list(states.keys()):
+        if path not in models and not states[path]["pending"]:
+            # Unmounted in the meantime
+            del states[path]
+    mountpoints = mountinfo.get_mountpoints() if mountinfo.available() else None
+    await asyncio.gather(
+        *[probe(path, mountpoints) for path in models if path not in remount_tasks]
+    )
+    if not health_remount:
+        return
+    now = time.monotonic()
+    for path, state in states.items():
+        if path in remount_tasks or now < state["next_remount"]:
+            continue
+        model = state["pending"]
+        if not model and state["status"] == "dead":
+            model = models[path]
+        if model:
+            task = asyncio.create_task(remount(path, model))
+            remount_tasks[path] = task
+            task.add_done_callback(lambda _, path=path: remount_tasks.pop(path, None))
+
+
+async def monitor():
+    while True:
+        await asyncio.sleep(health_interval)
+        try:
+            await check_all()
+        except:
+            getLogger().exception("Health check failed")
+
+
+def forget(path: str):
+    """Drops the probe state of an unmounted path and cancels its
+    remount, so it's not mounted again."""
+    states.pop(path, None)
+    task = remount_tasks.pop(path, None)
+    if task and task is not asyncio.current_task():
+        task.cancel()
+
+
+def start():
+    global monitor_task
+    if health_interval > 0:
+        monitor_task = asyncio.create_task(monitor())
+
+
+async def stop():
+    tasks = list(remount_tasks.values())
+    if monitor_task:
+        tasks.append(monitor_task)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def report(path: str) -> dict:
+    """Probe state and latency percentiles (seconds) of a mount."""
+    state = states.get(path, None)
+    if not state:
+        return None
+    latencies = list(state["latencies"])
+    return {
+        "status": state["status"],
+        "failures": state["failures"],
+        "last_probe": state["last_probe"],
+        "last_error": state["last_error"],
+        "latency": {
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+        },
+        "remounts": state["remounts"],
+    }
@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+import time
+import uuid
+
+import registry
+from cache import TTLCache
+from log import getLogger
+from values import job_queue_size
+from values import job_ttl
+from values import job_workers
+
+subscriber_queue_size = 100
+
+current_job = contextvars.ContextVar("current_job", default=None)
+# Finished jobs are kept for job_ttl seconds to be polled
+jobs = TTLCache(maxsize=10000, ttl=job_ttl)
+# path -> job that's queued or running for it
+active = {}
+queue = None
+workers = []
+
+
+class Job:
+    """A mount request processed by the work queue.
+
+    Status goes from queued over running to succeeded or failed. While
+    running, the mount reports the phase it's in via phase().
+    """
+
+    def __init__(self, path: str, run):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.run = run
+        self.status = "queued"
+        self.phases = [{"phase": "queued", "time": time.time()}]
+        self.result = None
+        self.subscribers = set()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ["succeeded", "failed"]
+
+    def update(self, status: str = None, phase: str = None, result: dict = None):
+        if status:
+            self.status = status
+        if phase:
+            self.phases.append({"phase": phase, "time": time.time()})
+        if result:
+            self.result = result
+        state = self.to_dict()
+        # Other workers answer polls of this job from the registry
+        registry.save_job(state)
+        for subscriber in self.subscribers:
+            try:
+                subscriber.put_nowait(state)
+            except asyncio.QueueFull:
+                pass
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "path": self.path,
+            "status": self.status,
+            "phase": self.phases[-1]["phase"],
+            "phases": list(self.phases),
+            "result": self.result,
+        }
+
+    def subscribe(self):
+        """Returns a queue receiving the state after every update."""
+        subscriber = asyncio.Queue(maxsize=subscriber_queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+
+def phase(name: str):
+    """Reports the phase of the job running the current mount, if any."""
+    job = current_job.get()
+    if job is not None:
+        job.update(phase=name)
+
+
+def get(job_id: str):
+    return jobs.get(job_id)
+
+
+async def get_state(job_id: str):
+    """State of a job of this or, with a shared registry, another worker."""
+    job = jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    return await registry.get_job(job_id)
+
+
+def submit(path: str, run) -> Job:
+    """Queues run(), a coroutine function returning (status_code, content).
+
+    Returns the job already queued or running for the path instead of
+    adding a second one, so clients retrying a slow mount don't double
+    the work. Raises asyncio.QueueFull if the queue is full.
+    """
+    job = active.get(path, None)
+    if job is not None:
+        return job
+    job = Job(path, run)
+    queue.put_nowait(job)
+    active[path] = job
+    jobs.set(job.id, job)
+    registry.save_job(job.to_dict())
+    return job
+
+
+async def worker():
+    log = getLogger()
+    while True:
+        job = await queue.get()
+        token = current_job.set(job)
+        try:
+            job.update(status="running", phase="running")
+            status_code, content = await job.run()
+            job.update(
+                status="succeeded" if status_code < 300 else "failed",
+                phase="done",
+                result={"status_code": status_code, "content": content},
+            )
+        except Exception as e:
+            log.exception(f"Job {job.id} for {job.path} failed")
+            job.update(
+                status="failed",
+                phase="done",
+                result={"status_code": 500, "content": {"detail": str(e)}},
+            )
+        finally:
+            current_job.reset(token)
+            active.pop(job.path, None)
+            # Refresh the TTL, it counts from the end of the job
+            jobs.set(job.id, job)
+            queue.task_done()
+
+
+def start():
+    global queue
+    queue = asyncio.Queue(maxsize=job_queue_size)
+    for _ in range(job_workers):
+        workers.append(asyncio.create_task(worker()))
+
+
+async def stop():
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    workers.clear()
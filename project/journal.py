@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import os
+import signal
+
+from values import config_store_dir
+from values import journal_path
+from values import mount_journal
+from values import shared_registry
+
+# path -> last mount record, mirrors the journal file
+records = {}
+appended = 0
+
+
+def enabled() -> bool:
+    return mount_journal
+
+
+def log_file(path: str) -> str:
+    """Output file of the mount process of a path."""
+    name = hashlib.sha256(path.encode()).hexdigest()[:16]
+    return os.path.join(config_store_dir, "logs", f"{name}.log")
+
+
+def open_log_file(path: str) -> int:
+    """Opened for appending, so the process keeps writing at the end when
+    the file is truncated (see output.LogFileOutput)."""
+    location = log_file(path)
+    os.makedirs(os.path.dirname(location), mode=0o700, exist_ok=True)
+    return os.open(location, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o600)
+
+
+def remove_log_file(path: str):
+    try:
+        os.remove(log_file(path))
+    except FileNotFoundError:
+        pass
+
+
+def process_start_time(pid: int):
+    """Start time of a process in clock ticks since boot, tells a process
+    apart from a later one reusing its pid. None if it's gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rpartition(")")[2].split()
+    except OSError:
+        return None
+    if fields[0] in ["Z", "X"]:
+        return None
+    return int(fields[19])
+
+
+def _open(location: str, flags: int):
+    os.makedirs(os.path.dirname(location), mode=0o700, exist_ok=True)
+    return os.fdopen(os.open(location, os.O_WRONLY | os.O_CREAT | flags, 0o600), "w")
+
+
+def append(entry: dict):
+    global appended
+    with _open(journal_path, os.O_APPEND) as f:
+        f.write(json.dumps(entry, default=str) + "\n")
+    appended += 1
+    # Rewrite the file once it's mostly made of outdated entries
+    if appended > 2 * len(records) + 100:
+        compact()
+
+
+def record_mount(path: str, record: dict):
+    """Records a mount, containing its model (with credentials). The file
+    is readable by the owner only and lives in the tmpfs config store
+    by default. The shared registry replaces the journal, if enabled."""
+    if not mount_journal or shared_registry:
+        return
+    records[path] = record
+    append({"op": "mount", "path": path, **record})
+
+
+def record_unmount(path: str):
+    if not mount_journal or path not in records:
+        return
+    del records[path]
+    append({"op": "unmount", "path": path})
+
+
+def load() -> dict:
+    """Replays the journal, returns the last record of every mount."""
+    global records
+    records = {}
+    if not os.path.exists(journal_path):
+        return {}
+    with open(journal_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Torn write of a crashed process
+                continue
+            path = entry.pop("path")
+            if entry.pop("op") == "mount":
+                records[path] = entry
+            else:
+                records.pop(path, None)
+    return dict(records)
+
+
+def compact(current: dict = None):
+    """Rewrites the journal with one record per mount."""
+    global appended
+    global records
+    if current is not None:
+        records = dict(current)
+    tmp_path = f"{journal_path}.tmp"
+    with _open(tmp_path, os.O_TRUNC) as f:
+        for path, record in records.items():
+            entry = {"op": "mount", "path": path, **record}
+            f.write(json.dumps(entry, default=str) + "\n")
+    os.replace(tmp_path, journal_path)
+    appended = 0
+
+
+class AdoptedProcess:
+    """A mount process started by a previous instance of this service.
+
+    It's no child of this process, so it can't be waited for directly.
+    Offers the parts of asyncio.subprocess.Process used for mounts.
+    """
+
+    poll_interval = 1.0
+
+    def __init__(self, pid: int, start_time: int):
+        self.pid = pid
+        self.start_time = start_time
+
+    @property
+    def returncode(self):
+        # The exit code of a process that's not our child is unknown
+        return None if process_start_time(self.pid) == self.start_time else -1
+
+    async def wait(self):
+        while self.returncode is None:
+            await asyncio.sleep(self.poll_interval)
+        return self.returncode
+
+    def _signal(self, sig: int):
+        if self.returncode is not None:
+            raise ProcessLookupError(self.pid)
+        os.kill(self.pid, sig)
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+
+def adopt(record: dict):
+    """The process of a mount record if it's still running, else None."""
+    pid = record.get("pid", None)
+    if pid is None or process_start_time(pid) != record.get("start_time", None):
+        return None
+    return AdoptedProcess(pid, record["start_time"])
@@ -1,52 +1,198 @@
+import atexit
 import json
-import logging
+import logging.handlers
 import os
+import queue
 import socket
 import sys
+import threading
+import time
 from copy import deepcopy
 
-from jsonformatter import JsonFormatter
 from values import base_mount_dir
+from values import log_queue_block_timeout
+from values import log_queue_full_policy
+from values import log_queue_size
+from values import logging_config_path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logged_logger_name = "DataMount"
 logger = None
 
+# The configured handlers by name. They run on the listener thread, the
+# root logger only has the QueueHandler, so logging never blocks the
+# event loop on a slow disk, SMTP relay or syslog server.
+handlers = {}
+log_queue = queue.Queue(log_queue_size)
+queue_handler = None
+listener = None
+dropped = 0
+reported = 0
+reported_at = 0
+report_interval = 10
+dropped_lock = threading.Lock()
+
+
+# Attributes every LogRecord has, the others were passed as extra
+reserved_attributes = frozenset(logging.makeLogRecord({}).__dict__) | {
+    "asctime",
+    "message",
+}
+
 
-class ExtraFormatter(logging.Formatter):
-    dummy = logging.LogRecord(None, None, None, None, None, None, None)
-    ignored_extras = [
-        "args",
-        "asctime",
-        "created",
-        "exc_info",
-        "filename",
-        "funcName",
-        "levelname",
-        "levelno",
-        "lineno",
-        "message",
-        "module",
-        "msecs",
-        "msg",
-        "name",
-        "pathname",
-        "process",
-        "processName",
-        "relativeCreated",
-        "stack_info",
-        "thread",
-        "threadName",
-    ]
+class CachedTimeFormatter(logging.Formatter):
+    """Formatter reusing the strftime() result of the current second."""
 
+    cached_time = (None, None)
+
+    def formatTime(self, record, datefmt=None):
+        if datefmt:
+            return super().formatTime(record, datefmt)
+        second = int(record.created)
+        cached_second, text = self.cached_time
+        if second != cached_second:
+            text = time.strftime(self.default_time_format, self.converter(second))
+            self.cached_time = (second, text)
+        return self.default_msec_format % (text, record.msecs)
+
+
+class ExtraFormatter(CachedTimeFormatter):
     def format(self, record):
-        extra_txt = ""
-        for k, v in record.__dict__.items():
-            if k not in self.dummy.__dict__ and k not in self.ignored_extras:
-                extra_txt += " --- {}={}".format(k, v)
         message = super().format(record)
+        extra_txt = "".join(
+            [
+                f" --- {k}={v}"
+                for k, v in record.__dict__.items()
+                if k not in reserved_attributes
+            ]
+        )
         return message + extra_txt
 
 
+class JsonLineFormatter(CachedTimeFormatter):
+    """One JSON object per record, with the keys of fmt followed by the
+    extras, like jsonformatter's JsonFormatter with mix_extra. Values of
+    fmt naming a record attribute are replaced by it, the others are
+    constants. Values JSON can't represent are logged as str(). Encoded
+    with orjson if it's installed."""
+
+    def __init__(self, fmt: dict):
+        super().__init__()
+        self.fields = [
+            (key, value, value in reserved_attributes) for key, value in fmt.items()
+        ]
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        for text in (record.exc_text, record.stack_info):
+            if text:
+                if message[-1:] != "\n":
+                    message += "\n"
+                message += text
+        record.message = message
+        record.asctime = self.formatTime(record)
+        result = {
+            key: getattr(record, value) if attribute else value
+            for key, value, attribute in self.fields
+        }
+        for k, v in record.__dict__.items():
+            if k not in reserved_attributes:
+                result[k] = v
+        if orjson is not None:
+            return orjson.dumps(result, default=str).decode()
+        return json.dumps(result, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler for a bounded queue. Records arriving while it's full
+    are dropped and counted."""
+
+    def enqueue(self, record):
+        global dropped
+        try:
+            if log_queue_full_policy == "block":
+                self.queue.put(record, timeout=log_queue_block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            with dropped_lock:
+                dropped += 1
+
+
+class Listener(logging.handlers.QueueListener):
+    """Passes the queued records to the handlers. Dropped records are
+    reported once the queue drained, at most every report_interval
+    seconds while it stays full."""
+
+    def handle(self, record):
+        global reported
+        global reported_at
+        count = dropped - reported
+        if count > 0 and (
+            self.queue.empty() or time.monotonic() - reported_at > report_interval
+        ):
+            reported += count
+            reported_at = time.monotonic()
+            super().handle(
+                logging.makeLogRecord(
+                    {
+                        "name": record.name,
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": f"Logging queue full, dropped {count} records",
+                    }
+                )
+            )
+        super().handle(record)
+
+    def enqueue_sentinel(self):
+        # Waits for room, the queue is bounded
+        self.queue.put(self._sentinel)
+
+
+def start_listener():
+    """(Re)starts the listener thread with the current handlers."""
+    global listener
+    stop_listener()
+    listener = Listener(log_queue, *handlers.values(), respect_handler_level=True)
+    listener.start()
+
+
+def stop_listener():
+    """Stops the listener after it handled the queued records."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def restart_after_fork():
+    # Workers forked from a preloaded app don't inherit the listener
+    # thread, and the queue may be locked by it. Records queued in the
+    # parent are the parent's to handle.
+    global log_queue
+    global listener
+    global dropped
+    global reported
+    if listener is None:
+        return
+    dropped = reported = 0
+    log_queue = queue.Queue(log_queue_size)
+    queue_handler.queue = log_queue
+    listener = None
+    start_listener()
+
+
+os.register_at_fork(after_in_child=restart_after_fork)
+atexit.register(stop_listener)
+
+
 # Translate level to int
 def get_level(level_str):
     if type(level_str) == int:
@@ -74,7 +220,7 @@ supported_handler_classes = {
 # supported formatters and their arguments
 hostname = os.environ.get("HOSTNAME", "unknown")
 supported_formatter_classes = {
-    "json": JsonFormatter,
+    "json": JsonLineFormatter,
     "simple": ExtraFormatter,
     "simple_user": ExtraFormatter,
 }
@@ -92,7 +238,7 @@ json_fmt = {
 simple_fmt = f"%(asctime)s logger={logged_logger_name} hostname={hostname} levelno=%(levelno)s levelname=%(levelname)s file=%(pathname)s line=%(lineno)d function=%(funcName)s : %(message)s"
 simple_user = f"%(asctime)s levelname=%(levelname)s file=%(pathname)s line=%(lineno)d: %(message)s"
 supported_formatter_kwargs = {
-    "json": {"fmt": json_fmt, "mix_extra": True},
+    "json": {"fmt": json_fmt},
     "simple": {"fmt": simple_fmt},
     "simple_user": {"fmt": simple_user},
 }
@@ -106,9 +252,7 @@ def getLogger():
 
 
 def createLogger():
-    logging_config_path = os.environ.get(
-        "LOGGING_CONFIG_FILE", "/mnt/config/logging.json"
-    )
+    global queue_handler
     logger = logging.getLogger()
     logging_config = {
         "stream": {
@@ -130,60 +274,76 @@ def createLogger():
             logging_config_update = json.load(f)
         logging_config.update(logging_config_update)
 
-    logger_handlers = logger.handlers
-    handler_names = [x.name for x in logger.handlers]
-    for handler_name, handler_config in logging_config.items():
-        if (not handler_config.get("enabled", False)) and handler_name in handler_names:
-            # Handler was disabled, remove it
-            logger.debug(f"Logging handler remove ({handler_name}) ... ")
-            logger.handlers = [x for x in logger_handlers if x.name != handler_name]
-            logger.debug(f"Logging handler remove ({handler_name}) ... done")
-        elif handler_config.get("enabled", False):
-            # Recreate handlers which has changed their config
-            configuration = deepcopy(handler_config)
-
-            # map some special values
-            if handler_name == "stream":
-                if configuration["stream"] == "ext://sys.stdout":
-                    configuration["stream"] = sys.stdout
-                elif configuration["stream"] == "ext://sys.stderr":
-                    configuration["stream"] = sys.stderr
-            elif handler_name == "syslog":
-                if configuration["socktype"] == "ext://socket.SOCK_STREAM":
-                    configuration["socktype"] = socket.SOCK_STREAM
-                elif configuration["socktype"] == "ext://socket.SOCK_DGRAM":
-                    configuration["socktype"] = socket.SOCK_DGRAM
-                if configuration["address"]:
-                    configuration["address"] = tuple(configuration["address"])
-            _ = configuration.pop("enabled")
-            formatter_name = configuration.pop("formatter")
-            level = get_level(configuration.pop("level"))
-            none_keys = []
-            for key, value in configuration.items():
-                if value is None:
-                    none_keys.append(key)
-            for x in none_keys:
-                _ = configuration.pop(x)
-
-            # Create handler, formatter, and add it
-            handler = supported_handler_classes[handler_name](**configuration)
-            formatter = supported_formatter_classes[formatter_name](
-                **supported_formatter_kwargs[formatter_name]
-            )
-            handler.name = handler_name
-            handler.setLevel(level)
-            handler.setFormatter(formatter)
-            if handler_name in handler_names:
-                # Remove previously added handler
-                logger.handlers = [x for x in logger_handlers if x.name != handler_name]
-            logger.addHandler(handler)
-
-            if "filename" in configuration:
-                # filename is already used in log.x(extra)
-                configuration["file_name"] = configuration["filename"]
-                del configuration["filename"]
-            logger.debug(
-                f"Logging handler added ({handler_name})",
-                extra=configuration,
-            )
+    if queue_handler is None:
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.name = "queue"
+        logger.addHandler(queue_handler)
+
+    # Handlers are swapped while the listener is stopped
+    stop_listener()
+    replaced = []
+    for handler_name in list(handlers):
+        if handler_name not in logging_config:
+            # Dropped from the config file
+            replaced.append(handlers.pop(handler_name))
+    try:
+        for handler_name, handler_config in logging_config.items():
+            if (not handler_config.get("enabled", False)) and handler_name in handlers:
+                # Handler was disabled, remove it
+                logger.debug(f"Logging handler remove ({handler_name}) ... ")
+                replaced.append(handlers.pop(handler_name))
+                logger.debug(f"Logging handler remove ({handler_name}) ... done")
+            elif handler_config.get("enabled", False):
+                # Recreate handlers which has changed their config
+                configuration = deepcopy(handler_config)
+
+                # map some special values
+                if handler_name == "stream":
+                    if configuration["stream"] == "ext://sys.stdout":
+                        configuration["stream"] = sys.stdout
+                    elif configuration["stream"] == "ext://sys.stderr":
+                        configuration["stream"] = sys.stderr
+                elif handler_name == "syslog":
+                    if configuration["socktype"] == "ext://socket.SOCK_STREAM":
+                        configuration["socktype"] = socket.SOCK_STREAM
+                    elif configuration["socktype"] == "ext://socket.SOCK_DGRAM":
+                        configuration["socktype"] = socket.SOCK_DGRAM
+                    if configuration["address"]:
+                        configuration["address"] = tuple(configuration["address"])
+                _ = configuration.pop("enabled")
+                formatter_name = configuration.pop("formatter")
+                level = get_level(configuration.pop("level"))
+                none_keys = []
+                for key, value in configuration.items():
+                    if value is None:
+                        none_keys.append(key)
+                for x in none_keys:
+                    _ = configuration.pop(x)
+
+                # Create handler, formatter, and add it
+                handler = supported_handler_classes[handler_name](**configuration)
+                formatter = supported_formatter_classes[formatter_name](
+                    **supported_formatter_kwargs[formatter_name]
+                )
+                handler.name = handler_name
+                handler.setLevel(level)
+                handler.setFormatter(formatter)
+                if handler_name in handlers:
+                    # Remove previously added handler
+                    replaced.append(handlers[handler_name])
+                handlers[handler_name] = handler
+
+                if "filename" in configuration:
+                    # filename is already used in log.x(extra)
+                    configuration["file_name"] = configuration["filename"]
+                    del configuration["filename"]
+                logger.debug(
+                    f"Logging handler added ({handler_name})",
+                    extra=configuration,
+                )
+    finally:
+        # A handler failing to start must not stop the others
+        start_listener()
+        for handler in replaced:
+            handler.close()
     return logger
@@ -1,88 +1,352 @@
+import asyncio
+import json
 import os
 from contextlib import asynccontextmanager
+from typing import List
 
+import config_watch
+import health
+import jobs
+import journal
+import metrics
+import profiles
+import rcd
+import registry
+import tracing
 import utils
+import vfs_cache
+from fastapi import Body
 from fastapi import FastAPI
 from fastapi import Query
+from fastapi import Request
 from fastapi import Response
 from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from log import getLogger
 from models import DataMountModel
+from output import follow_log_file
+from output import read_log_file
 from values import base_mount_dir
+from values import batch_parallelism
+from values import gunicorn_workers
+from values import init_mounts_background
+from values import shared_registry
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await utils.init_mounts()
+    tracing.setup()
+    profiles.load()
+    if gunicorn_workers > 1 and not shared_registry:
+        # Every worker would only know its own mounts
+        raise Exception("GUNICORN_WORKERS > 1 requires SHARED_REGISTRY=true")
+    if rcd.enabled and shared_registry:
+        # The daemon of one worker can't be reached from the others
+        raise Exception("RCLONE_BACKEND=rcd can't be combined with SHARED_REGISTRY")
+    if rcd.enabled:
+        await rcd.start()
+    await utils.reattach_mounts()
+    if init_mounts_background:
+        # Serve right away, GET /ready reports the progress
+        init_task = asyncio.create_task(utils.init_mounts(utils.load_init_mounts()))
+    else:
+        await utils.init_mounts()
+    jobs.start()
+    health.start()
+    config_watch.start()
     yield
 
-    mount_paths = list(utils.get_mounts().keys())
-    for path in mount_paths:
-        await utils.unmount(path, force=True)
+    await config_watch.stop()
+    await health.stop()
+    await jobs.stop()
+
+    if init_mounts_background and not init_task.done():
+        init_task.cancel()
+        await asyncio.gather(init_task, return_exceptions=True)
+
+    if journal.enabled() or shared_registry:
+        # Left running for the next instance or the other workers to
+        # reattach. With a shared registry, the gunicorn master unmounts
+        # what's left when it exits (see gunicorn_http.py).
+        log.info(f"Keep {len(utils.get_mounts())} mounts for reattachment")
+    else:
+        await utils.unmount_all()
+    if rcd.enabled:
+        await rcd.stop()
+    tracing.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
 
 log = getLogger()
+job_poll_interval = 0.5
+
+metrics.register_collector(utils.get_mounts, utils.get_processes)
+
+
+async def trace_requests(request: Request, call_next):
+    with tracing.span("request", method=request.method, route=request.url.path):
+        return await call_next(request)
+
+
+# Registered only with tracing, the middleware adds overhead to every request
+if tracing.exporter != "none":
+    app.middleware("http")(trace_requests)
+
+
+async def mount_request(item: DataMountModel):
+    """Mounts under the path lock. Returns status code and response content."""
+    jobs.phase("waiting_for_lock")
+    async with utils.get_path_lock(item.path):
+        if await registry.get(item.path) is not None:
+            log.warning(f"{item.path} already mounted")
+            return 400, {"detail": f"{item.path} already mounted"}
+        try:
+            success, error_process = await utils.mount(item)
+            if success:
+                return 204, None
+            else:
+                return 400, error_process
+        except Exception as e:
+            log.exception(f"Mount {item.path} failed")
+            fullpath = os.path.join(base_mount_dir, item.path)
+            jobs.phase("cleanup")
+            try:
+                await utils.unmount(item.path, force=True)
+            except:
+                log.exception(
+                    "After mount failed the attempt to unmount it threw an exception as well"
+                )
+                pass
+            err = str(e).replace(fullpath, item.path)
+            return 400, {"detail": err}
 
 
 @app.post("/")
-async def post(item: DataMountModel):
+async def post(item: DataMountModel, async_: bool = Query(False, alias="async")):
     try:
         utils.validate(item)
     except Exception as e:
         log.exception("Validation failed")
         return JSONResponse(status_code=400, content={"detail": str(e)})
-    async with utils.get_lock():
-        if item.path in utils.get_mounts():
-            log.warning(f"{item.path} already mounted")
+    if async_:
+        try:
+            job = jobs.submit(item.path, lambda: mount_request(item))
+        except asyncio.QueueFull:
             return JSONResponse(
-                status_code=400, content={"detail": f"{item.path} already mounted"}
+                status_code=503,
+                content={"detail": "Too many pending mounts"},
+                headers={"Retry-After": "5"},
             )
-    try:
-        async with utils.get_lock():
-            success, error_process = await utils.mount(item)
-        if success:
-            return Response(status_code=204)
-        else:
-            return JSONResponse(status_code=400, content=error_process)
-    except Exception as e:
-        log.exception(f"Mount {item.path} failed")
-        fullpath = os.path.join(base_mount_dir, item.path)
+        return JSONResponse(
+            status_code=202,
+            content=job.to_dict(),
+            headers={"Location": f"/jobs/{job.id}"},
+        )
+    status_code, content = await mount_request(item)
+    if status_code == 204:
+        return Response(status_code=204)
+    return JSONResponse(status_code=status_code, content=content)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, stream: bool = Query(False)):
+    job = jobs.get(job_id)
+    state = await jobs.get_state(job_id)
+    if not state:
+        return JSONResponse(status_code=404, content={"detail": "Job not found"})
+    if not stream:
+        return JSONResponse(content=state)
+    if not job:
+        # Job of another worker, poll the registry
+        async def remote_events():
+            state = await jobs.get_state(job_id)
+            phases = 0
+            while state:
+                if len(state["phases"]) > phases:
+                    phases = len(state["phases"])
+                    yield f"data: {json.dumps(state)}\n\n"
+                if state["status"] in ["succeeded", "failed"]:
+                    break
+                await asyncio.sleep(job_poll_interval)
+                state = await jobs.get_state(job_id)
+
+        return StreamingResponse(remote_events(), media_type="text/event-stream")
+
+    async def events():
+        queue = job.subscribe()
         try:
-            await utils.unmount(item.path, force=True)
-        except:
-            log.exception("After mount failed the attempt to unmount it threw an exception as well")
-            pass
-        err = str(e).replace(fullpath, item.path)
-        return JSONResponse(status_code=400, content={"detail": err})
+            state = job.to_dict()
+            while True:
+                yield f"data: {json.dumps(state)}\n\n"
+                if state["status"] in ["succeeded", "failed"]:
+                    break
+                state = await queue.get()
+        finally:
+            job.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 
 @app.get("/")
 async def get():
-    async with utils.get_lock():
-        models = []
-        for path, entry in utils.get_mounts().items():
-            options = entry["model"].get("options", {})
-            if entry["model"].get("options", {}).get("external", False):
-                options["config"] = {}
-            models.append({"path": path, "options": options})
-        return JSONResponse(content=models)
+    # Mounts of all workers, health and cache usage are known for the
+    # ones of this worker only
+    entries = list((await registry.all()).items())
+    cache_usage = await vfs_cache.usage()
+    models = []
+    for path, entry in entries:
+        options = dict(entry["model"].get("options", {}))
+        if options.get("external", False):
+            options["config"] = {}
+        model = {"path": path, "options": options}
+        if entry.get("profile"):
+            model["profile"] = entry["profile"]
+        health_report = health.report(path)
+        if health_report:
+            model["health"] = health_report
+        if path in cache_usage:
+            model["cache"] = cache_usage[path]
+        models.append(model)
+    return JSONResponse(content=models)
 
 
-@app.delete("/{path:path}")
-async def delete(path: str, force: bool = Query(True)):
-    if path not in utils.get_mounts():
+@app.get("/metrics")
+async def get_metrics():
+    content, content_type = metrics.latest()
+    return Response(content=content, media_type=content_type)
+
+
+@app.get("/ready")
+async def ready():
+    state = utils.get_init_mounts_state()
+    pending = [path for path, value in state.items() if value == "pending"]
+    return JSONResponse(
+        status_code=503 if pending else 200,
+        content={"ready": not pending, "init_mounts": state},
+    )
+
+
+@app.get("/{path:path}/logs")
+async def logs(path: str, stream: bool = Query(False), tail: int = Query(None)):
+    entry = utils.get_mounts().get(path, None)
+    if not entry:
+        record = await registry.get(path)
+        if record is not None and record["log_file"]:
+            return remote_logs(path, record, stream, tail)
         log.debug(f"{path} not found")
         return JSONResponse(status_code=404, content={"detail": "Mount not found"})
-    try:
-        async with utils.get_lock():
+    output = entry.get("output", None)
+    if entry.get("backend", None) == "rcd":
+        # All rcd mounts share the output of the daemon
+        output = rcd.output
+    lines = list(output.lines) if output else []
+    if tail is not None:
+        lines = lines[-tail:] if tail > 0 else []
+    if not stream:
+        return JSONResponse(content={"path": path, "lines": lines})
+
+    async def events():
+        for line in lines:
+            yield f"data: {json.dumps(line)}\n\n"
+        if not output:
+            return
+        queue = output.subscribe()
+        try:
+            while True:
+                line = await queue.get()
+                if line is None:
+                    break
+                yield f"data: {json.dumps(line)}\n\n"
+        finally:
+            output.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def remote_logs(path: str, record: dict, stream: bool, tail: int):
+    """Logs of a mount of another worker, read from its log file."""
+    lines, offset = read_log_file(journal.log_file(path))
+    if tail is not None:
+        lines = lines[-tail:] if tail > 0 else []
+    if not stream:
+        return JSONResponse(content={"path": path, "lines": lines})
+
+    async def events():
+        for line in lines:
+            yield f"data: {json.dumps(line)}\n\n"
+        process = journal.adopt(record)
+        if process is None:
+            return
+        async for line in follow_log_file(journal.log_file(path), offset, process):
+            yield f"data: {json.dumps(line)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+async def unmount_request(path: str, force: bool):
+    """Unmounts under the path lock. Returns status code and response content."""
+    async with utils.get_path_lock(path):
+        # Also when it's not mounted, a failed remount may be pending
+        health.forget(path)
+        if await registry.get(path) is None:
+            log.debug(f"{path} not found")
+            return 404, {"detail": "Mount not found"}
+        try:
             log.info(f"Unmount {path} ...")
             await utils.unmount(path, force=force)
             log.info(f"Unmount {path} ... successful")
+            return 204, None
+        except Exception as e:
+            log.exception(f"Unmount {path} ... failed")
+            fullpath = os.path.join(base_mount_dir, path)
+            err = str(e).replace(fullpath, path)
+            return 400, {"detail": err}
+
+
+async def run_batch(paths: list, run) -> JSONResponse:
+    """Runs run(i) for every entry with bounded parallelism, returns the
+    results in the order of the request."""
+    semaphore = asyncio.Semaphore(batch_parallelism)
+
+    async def limited(i):
+        async with semaphore:
+            return await run(i)
+
+    results = await asyncio.gather(*[limited(i) for i in range(len(paths))])
+    return JSONResponse(
+        content=[
+            {"path": path, "status_code": status_code, "content": content}
+            for path, (status_code, content) in zip(paths, results)
+        ]
+    )
+
+
+@app.post("/batch")
+async def post_batch(items: List[DataMountModel]):
+    async def run(i):
+        try:
+            utils.validate(items[i])
+        except Exception as e:
+            log.exception("Validation failed")
+            return 400, {"detail": str(e)}
+        return await mount_request(items[i])
+
+    return await run_batch([item.path for item in items], run)
+
+
+# Defined before DELETE /{path}, which would match /batch as well
+@app.delete("/batch")
+async def delete_batch(paths: List[str] = Body(...), force: bool = Query(True)):
+    async def run(i):
+        return await unmount_request(paths[i], force)
+
+    return await run_batch(paths, run)
+
+
+@app.delete("/{path:path}")
+async def delete(path: str, force: bool = Query(True)):
+    status_code, content = await unmount_request(path, force)
+    if status_code == 204:
         return Response(status_code=204)
-    except Exception as e:
-        log.exception(f"Unmount {path} ... failed")
-        fullpath = os.path.join(base_mount_dir, path)
-        err = str(e).replace(fullpath, path)
-        return JSONResponse(status_code=400, content={"detail": err})
+    return JSONResponse(status_code=status_code, content=content)
@@ -0,0 +1,280 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+
+import log
+import tracing
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import generate_latest
+from prometheus_client import Histogram
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.core import GaugeMetricFamily
+
+buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+mount_phase = Histogram(
+    "datamount_mount_phase_seconds",
+    "Duration of the phases of a mount",
+    ["phase", "template", "type"],
+    buckets=buckets,
+)
+unmount_phase = Histogram(
+    "datamount_unmount_phase_seconds",
+    "Duration of the phases of an unmount",
+    ["phase", "backend"],
+    buckets=buckets,
+)
+obscure_duration = Histogram(
+    "datamount_obscure_seconds",
+    "Duration of obscuring a config value",
+    ["method"],
+    buckets=buckets,
+)
+mount_failures = Counter(
+    "datamount_mount_failures",
+    "Failed mounts by cause",
+    ["template", "cause"],
+)
+unmount_failures = Counter(
+    "datamount_unmount_failures",
+    "Failed unmounts",
+    ["backend"],
+)
+lock_wait = Histogram(
+    "datamount_lock_wait_seconds",
+    "Time spent waiting for a lock or the mount semaphore",
+    ["lock"],
+    buckets=buckets,
+)
+mount_queue = Gauge(
+    "datamount_mount_queue_depth",
+    "Mounts waiting for a free slot of the mount semaphore",
+)
+
+# Templates and backend types are free text of the request. Label values
+# are limited to known ones, anything else is counted as "other".
+rclone_types = frozenset(
+    [
+        "alias",
+        "azureblob",
+        "azurefiles",
+        "b2",
+        "box",
+        "cache",
+        "chunker",
+        "combine",
+        "compress",
+        "crypt",
+        "drive",
+        "dropbox",
+        "fichier",
+        "filefabric",
+        "ftp",
+        "google cloud storage",
+        "google photos",
+        "hasher",
+        "hdfs",
+        "hidrive",
+        "http",
+        "imagekit",
+        "internetarchive",
+        "jottacloud",
+        "koofr",
+        "linkbox",
+        "local",
+        "mailru",
+        "mega",
+        "memory",
+        "netstorage",
+        "onedrive",
+        "opendrive",
+        "oracleobjectstorage",
+        "pcloud",
+        "pikpak",
+        "premiumizeme",
+        "protondrive",
+        "putio",
+        "qingstor",
+        "quatrix",
+        "s3",
+        "seafile",
+        "sftp",
+        "sharefile",
+        "sia",
+        "smb",
+        "storj",
+        "sugarsync",
+        "swift",
+        "union",
+        "uptobox",
+        "webdav",
+        "yandex",
+        "zoho",
+    ]
+)
+known_templates = rclone_types | {"nfs", "uftp"}
+
+clock_ticks = os.sysconf("SC_CLK_TCK")
+page_size = os.sysconf("SC_PAGE_SIZE")
+
+
+@contextmanager
+def timer(histogram: Histogram, *labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - start)
+
+
+def known(value) -> str:
+    return value if value in known_templates else "other"
+
+
+def mount_labels(item) -> tuple:
+    """template and backend type labels of a mount."""
+    template = item.options.template
+    return known(template), known(item.options.config.get("type", template))
+
+
+def failure_cause(e: Exception) -> str:
+    message = str(e)
+    if isinstance(e, asyncio.TimeoutError) or message.startswith("Mount not ready"):
+        return "timeout"
+    if message.startswith("Process exited early"):
+        return "process_exit"
+    if message.startswith("Mount failed. Directory not usable"):
+        return "not_usable"
+    return type(e).__name__
+
+
+class TimedLock(asyncio.Lock):
+    """asyncio.Lock recording how long acquire() waited."""
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        self.wait = lock_wait.labels(name)
+
+    async def acquire(self):
+        start = time.perf_counter()
+        with tracing.span("lock_wait", lock=self.name):
+            result = await super().acquire()
+        self.wait.observe(time.perf_counter() - start)
+        return result
+
+
+class TimedSemaphore(asyncio.Semaphore):
+    """asyncio.Semaphore recording its wait time and queue depth."""
+
+    def __init__(self, value: int, name: str):
+        super().__init__(value)
+        self.name = name
+        self.wait = lock_wait.labels(name)
+
+    async def acquire(self):
+        start = time.perf_counter()
+        mount_queue.inc()
+        try:
+            with tracing.span("lock_wait", lock=self.name):
+                result = await super().acquire()
+        finally:
+            mount_queue.dec()
+        self.wait.observe(time.perf_counter() - start)
+        return result
+
+
+def process_usage(pid: int) -> tuple:
+    """RSS in bytes and CPU seconds of a process, from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        # The command name may contain spaces, the fields start after it
+        fields = f.read().rpartition(")")[2].split()
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * page_size
+    return rss, (int(fields[11]) + int(fields[12])) / clock_ticks
+
+
+class MountCollector:
+    """Active mounts and the resource usage of their processes, sampled
+    when /metrics is scraped so the mount path pays nothing for it."""
+
+    def __init__(self, get_mounts, get_processes):
+        self.get_mounts = get_mounts
+        self.get_processes = get_processes
+
+    def collect(self):
+        active = GaugeMetricFamily(
+            "datamount_active_mounts",
+            "Active mounts",
+            labels=["template", "backend"],
+        )
+        # Summed per template and backend, a path label would add series
+        # without bound. The sums drop when a mount ends, so both are gauges.
+        rss = GaugeMetricFamily(
+            "datamount_mount_process_rss_bytes",
+            "Resident memory of the running mount processes",
+            labels=["template", "backend"],
+        )
+        cpu = GaugeMetricFamily(
+            "datamount_mount_process_cpu_seconds",
+            "CPU time of the running mount processes",
+            labels=["template", "backend"],
+        )
+        mounts = self.get_mounts()
+        counts = {}
+        for entry in list(mounts.values()):
+            key = (known(entry["model"]["options"]["template"]), entry["backend"])
+            counts[key] = counts.get(key, 0) + 1
+        for (template, backend), count in counts.items():
+            active.add_metric([template, backend], count)
+        usage = {}
+        for path, process in self.get_processes().items():
+            entry = mounts.get(path, None)
+            if entry is None:
+                # The rclone rcd, serving all mounts of the rcd backend
+                key = ("all", "rcd")
+            else:
+                key = (known(entry["model"]["options"]["template"]), entry["backend"])
+            try:
+                process_rss, process_cpu = process_usage(process.pid)
+            except (OSError, IndexError, ValueError):
+                continue
+            total_rss, total_cpu = usage.get(key, (0, 0.0))
+            usage[key] = total_rss + process_rss, total_cpu + process_cpu
+        for (template, backend), (total_rss, total_cpu) in usage.items():
+            rss.add_metric([template, backend], total_rss)
+            cpu.add_metric([template, backend], total_cpu)
+        return [active, rss, cpu]
+
+
+class LogQueueCollector:
+    """Depth of the logging queue and the records dropped at a full one."""
+
+    def collect(self):
+        depth = GaugeMetricFamily(
+            "datamount_log_queue_depth",
+            "Log records waiting for the handlers",
+        )
+        depth.add_metric([], log.log_queue.qsize())
+        dropped = CounterMetricFamily(
+            "datamount_log_records_dropped",
+            "Log records dropped because the logging queue was full",
+        )
+        dropped.add_metric([], log.dropped)
+        return [depth, dropped]
+
+
+REGISTRY.register(LogQueueCollector())
+
+
+def register_collector(get_mounts, get_processes):
+    REGISTRY.register(MountCollector(get_mounts, get_processes))
+
+
+def latest() -> tuple:
+    """Exposition output and its content type."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,4 +1,7 @@
+from typing import Optional
+
 from pydantic import BaseModel
+from pydantic import Field
 
 
 class DataMountOption(BaseModel):
@@ -6,6 +9,12 @@ class DataMountOption(BaseModel):
     template: str
     external: bool = False
     readonly: bool = False
+    # Set to False to always run the config check against the remote
+    cache_check: bool = True
+    # Relative share of the VFS cache budget
+    cache_weight: float = Field(1.0, gt=0)
+    # Named performance profile, see profiles.py
+    profile: Optional[str] = None
     config: dict
 
 
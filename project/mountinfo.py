@@ -0,0 +1,154 @@
+import asyncio
+import os
+import select
+
+mountinfo_path = os.environ.get("MOUNTINFO_FILE", "/proc/self/mountinfo")
+# Used when the mount table does not support change notifications
+# (e.g. a regular file given via MOUNTINFO_FILE)
+poll_interval = 0.1
+
+
+def _unescape(field: str) -> str:
+    # The kernel escapes space, tab, newline and backslash as octal sequences
+    return (
+        field.replace("\\040", " ")
+        .replace("\\011", "\t")
+        .replace("\\012", "\n")
+        .replace("\\134", "\\")
+    )
+
+
+def parse_mountpoints(content: str) -> set:
+    mountpoints = set()
+    for line in content.splitlines():
+        fields = line.split(" ")
+        if len(fields) > 4:
+            mountpoints.add(_unescape(fields[4]))
+    return mountpoints
+
+
+def available() -> bool:
+    return os.path.exists(mountinfo_path)
+
+
+def get_mountpoints() -> set:
+    with open(mountinfo_path) as f:
+        return parse_mountpoints(f.read())
+
+
+def is_mounted(fullpath: str) -> bool:
+    return os.path.normpath(fullpath) in get_mountpoints()
+
+
+class MountInfoWatcher:
+    """Keeps track of the mount table and signals every change of it.
+
+    /proc/self/mountinfo reports changes as POLLPRI / POLLERR. An epoll
+    instance with the file registered becomes readable once such an event
+    is pending, so the epoll fd itself is handed to the event loop.
+    Re-reading the file acknowledges the event.
+    """
+
+    def __init__(self, path: str = None, interval: float = poll_interval):
+        self.path = path or mountinfo_path
+        self.interval = interval
+        self.fd = None
+        self.epoll = None
+        self.changed = asyncio.Event()
+        self.mountpoints = set()
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDONLY)
+        try:
+            epoll = select.epoll()
+        except (AttributeError, OSError):
+            epoll = None
+        if epoll:
+            try:
+                epoll.register(self.fd, select.EPOLLPRI | select.EPOLLERR)
+                asyncio.get_running_loop().add_reader(epoll.fileno(), self._on_event)
+                self.epoll = epoll
+            except OSError:
+                # Regular files can not be watched, fall back to polling
+                epoll.close()
+        self.mountpoints = self._read()
+        return self
+
+    def __exit__(self, *args):
+        if self.epoll:
+            asyncio.get_running_loop().remove_reader(self.epoll.fileno())
+            self.epoll.close()
+            self.epoll = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _read(self) -> set:
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return parse_mountpoints(b"".join(chunks).decode(errors="replace"))
+
+    def _on_event(self):
+        self.epoll.poll(0)
+        self.mountpoints = self._read()
+        self.changed.set()
+
+    async def wait(self, timeout: float):
+        """Waits up to timeout seconds for the next change."""
+        if self.epoll:
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+        else:
+            await asyncio.sleep(min(timeout, self.interval))
+            self.mountpoints = self._read()
+
+    def is_mounted(self, fullpath: str) -> bool:
+        return os.path.normpath(fullpath) in self.mountpoints
+
+
+async def wait_for_mount(fullpath: str, process=None, timeout: float = 30.0) -> bool:
+    """Waits until fullpath shows up in the mount table.
+
+    Returns True once it is mounted and False if process exited before
+    that happened. Raises asyncio.TimeoutError when the deadline is hit.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    process_exit = None
+    if process:
+        process_exit = asyncio.ensure_future(process.wait())
+    try:
+        with MountInfoWatcher() as watcher:
+            while not watcher.is_mounted(fullpath):
+                if process_exit and process_exit.done():
+                    # The mount may have appeared right before a one-shot
+                    # mount helper exited
+                    return watcher.is_mounted(fullpath) or is_mounted(fullpath)
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                waiters = [asyncio.ensure_future(watcher.wait(remaining))]
+                if process_exit:
+                    waiters.append(process_exit)
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                if not waiters[0].done():
+                    waiters[0].cancel()
+            return True
+    finally:
+        if process_exit and not process_exit.done():
+            process_exit.cancel()
+
+
+async def wait_for_unmount(fullpath: str, interval: float = 1.0):
+    """Waits until fullpath is no longer part of the mount table."""
+    with MountInfoWatcher(interval=interval) as watcher:
+        while watcher.is_mounted(fullpath):
+            await watcher.wait(interval)
@@ -1,14 +1,16 @@
-import ipaddress
 import os
 
+import fsops
+import nfs_policy
+import tracing
 from models import DataMountModel
 from values import base_mount_dir
-from values import gid
-from values import uid
+from values import nfs_enabled
+from values import nfs_pin_address
 
 
 def validate(item: DataMountModel):
-    if os.environ.get("NFS_ENABLED", "false") in ["false", "0"]:
+    if not nfs_enabled:
         description = {
             "error": "",
             "message": "Config not working. nfs disabled",
@@ -29,12 +31,8 @@ def validate(item: DataMountModel):
         }
         return False, description
 
-    blocked_nfs_list = os.getenv("NFS_BLOCKED_MOUNTS", "").split(",")
-    blocked_nfs_list = [cidr for cidr in blocked_nfs_list if cidr]
     server = item.options.config["server"]
-    ip = ipaddress.ip_address(server)
-
-    if any(ip in ipaddress.ip_network(cidr) for cidr in blocked_nfs_list):
+    if nfs_policy.forbidden(server):
         description = {
             "error": "",
             "message": f"Config not working. Server {server} forbidden",
@@ -44,35 +42,42 @@ def validate(item: DataMountModel):
     return True, None
 
 
-def cmd(item: DataMountModel):
-    validation, description = validate(item)
+async def cmd(item: DataMountModel):
+    with tracing.span("nfs.validate"):
+        validation, description = validate(item)
     if not validation:
         return validation, description
-    
+
     path = item.path
     server = item.options.config.get("server", "None")
+    with tracing.span("nfs.resolve", server=server):
+        try:
+            addresses = await nfs_policy.addresses(server)
+        except OSError:
+            addresses = []
+    if not addresses:
+        raise Exception(f"Config not working. Server {server} not found")
+    if nfs_policy.forbidden_addresses(server, addresses):
+        raise Exception(f"Config not working. Server {server} forbidden")
     remotepath = item.options.config.get("remotepath", "None")
     fullpath = os.path.join(base_mount_dir, path)
-    if not os.path.exists(fullpath):
-        os.makedirs(fullpath, exist_ok=True)
-        os.chown(fullpath, uid, gid)
-    if os.path.isdir(fullpath):
-        if os.listdir(fullpath):
-            raise Exception(f"Directory {path} is not empty.")
-    cmd = [
-        "timeout",
-        "3s",
-        "mount.nfs4"
-    ]
+    with tracing.span("nfs.prepare_mountpoint"):
+        await fsops.prepare_mountpoint(fullpath, path)
+    cmd = ["timeout", "3s", "mount.nfs4"]
     options = []
     if item.options.readonly:
         options.append("ro")
     if len(options) > 0:
-        options_str = ','.join(options)
+        options_str = ",".join(options)
         cmd.append("-o")
         cmd.append(options_str)
-    cmd.append(f"{server}:{remotepath}")
+    if nfs_pin_address or nfs_policy.parse_address(server) is not None:
+        # The checked address, mount.nfs4 could resolve the name differently
+        host = nfs_policy.host(addresses[0])
+    else:
+        host = server
+    cmd.append(f"{host}:{remotepath}")
     cmd.append(fullpath)
-    check_cmd = ["&&", "while", "grep", "-qs", f"\"{fullpath} \"", "/proc/mounts;", "do", "sleep", "1;", "done"]
-    cmd += check_cmd
-    return ["sh", "-c", ' '.join(cmd)]
+    # mount.nfs4 exits once the mount is established, utils.run_process
+    # picks it up from the mount table
+    return cmd
@@ -0,0 +1,194 @@
+"""Which NFS servers may be mounted.
+
+NFS_BLOCKED_MOUNTS and NFS_ALLOWED_MOUNTS are comma separated lists of
+networks (CIDR), addresses and hostnames. load() reads and compiles
+them into sorted, merged address intervals per IP version, a lookup is
+a binary search. Malformed entries fail the start instead of being taken for
+hostnames. A server is forbidden if it or one of its addresses is blocked.
+With an allow list it must also be listed, by name or with all of its
+addresses. Hostnames are resolved without blocking the event loop and
+cached for NFS_DNS_TTL seconds.
+"""
+import asyncio
+import bisect
+import ipaddress
+import os
+import re
+import socket
+
+from cache import TTLCache
+from values import nfs_dns_cache_size
+from values import nfs_dns_ttl
+
+dns_cache = TTLCache(maxsize=nfs_dns_cache_size, ttl=nfs_dns_ttl)
+# hostname -> running resolution, shared by concurrent requests
+resolving = {}
+hostname_label = re.compile(r"(?!-)[a-z0-9-]{1,63}(?<!-)")
+
+
+class Ranges:
+    """Merged, sorted address intervals of one IP version."""
+
+    def __init__(self, networks: list):
+        self.starts = []
+        self.ends = []
+        intervals = sorted(
+            (int(network.network_address), int(network.broadcast_address))
+            for network in networks
+        )
+        for start, end in intervals:
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __contains__(self, address: int) -> bool:
+        i = bisect.bisect_right(self.starts, address) - 1
+        return i >= 0 and address <= self.ends[i]
+
+
+class AddressList:
+    def __init__(self, entries: list, name: str):
+        networks = {4: [], 6: []}
+        self.hostnames = set()
+        for entry in entries:
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError:
+                if not valid_hostname(entry):
+                    raise Exception(f"{name}: invalid network or hostname {entry}")
+                self.hostnames.add(normalize_hostname(entry))
+                continue
+            networks[network.version].append(network)
+        self.ranges = {version: Ranges(n) for version, n in networks.items()}
+
+    def contains_address(self, ip) -> bool:
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        return int(ip) in self.ranges[ip.version]
+
+    def contains_hostname(self, hostname: str) -> bool:
+        return normalize_hostname(hostname) in self.hostnames
+
+
+def normalize_hostname(hostname: str) -> str:
+    return hostname.strip().rstrip(".").lower()
+
+
+def valid_hostname(hostname: str) -> bool:
+    """Whether it's a hostname, and not e.g. a mistyped network (10.0.0.0/33)
+    or address (10.0.0.256). A numeric top level label is an address."""
+    labels = normalize_hostname(hostname).split(".")
+    return (
+        len(".".join(labels)) <= 253
+        and all(hostname_label.fullmatch(label) for label in labels)
+        and not labels[-1].isdigit()
+    )
+
+
+def parse_address(server: str):
+    """The address of a server given as IP address, else None."""
+    try:
+        return ipaddress.ip_address(server.strip("[]").split("%")[0])
+    except ValueError:
+        return None
+
+
+class Policy:
+    def __init__(self, blocked: list, allowed: list):
+        self.blocked = AddressList(blocked, "NFS_BLOCKED_MOUNTS")
+        self.allowed = AddressList(allowed, "NFS_ALLOWED_MOUNTS") if allowed else None
+
+    def address_allowed(self, ip) -> bool:
+        if self.blocked.contains_address(ip):
+            return False
+        return self.allowed is None or self.allowed.contains_address(ip)
+
+    def forbidden(self, server: str) -> bool:
+        """Checks a server by its address or name, without resolving it.
+        A hostname that's not forbidden by name may still resolve to
+        forbidden addresses."""
+        ip = parse_address(server)
+        if ip is not None:
+            return not self.address_allowed(ip)
+        return self.blocked.contains_hostname(server)
+
+    def forbidden_addresses(self, server: str, addresses: list) -> list:
+        """Addresses of a hostname that forbid it."""
+        listed = self.allowed is not None and self.allowed.contains_hostname(server)
+        return [
+            ip
+            for ip in addresses
+            if self.blocked.contains_address(ip)
+            or not (listed or self.address_allowed(ip))
+        ]
+
+
+policy = None
+
+
+def entries(variable: str) -> list:
+    return [
+        entry.strip()
+        for entry in os.environ.get(variable, "").split(",")
+        if entry.strip()
+    ]
+
+
+def load():
+    """Compiles the policy from the current environment."""
+    global policy
+    policy = Policy(entries("NFS_BLOCKED_MOUNTS"), entries("NFS_ALLOWED_MOUNTS"))
+    dns_cache.clear()
+
+
+load()
+
+
+def forbidden(server: str) -> bool:
+    return policy.forbidden(server)
+
+
+async def _resolve(hostname: str) -> list:
+    infos = await asyncio.get_running_loop().getaddrinfo(
+        hostname, None, type=socket.SOCK_STREAM
+    )
+    # In the order of getaddrinfo, without duplicates
+    addresses = dict.fromkeys(parse_address(info[4][0]) for info in infos)
+    return [ip for ip in addresses if ip is not None]
+
+
+async def resolve(hostname: str) -> list:
+    """Addresses of a hostname. Raises OSError if it can't be resolved."""
+    hostname = normalize_hostname(hostname)
+    addresses = dns_cache.get(hostname)
+    if addresses is not None:
+        return addresses
+    task = resolving.get(hostname, None)
+    if task is None:
+        task = asyncio.ensure_future(_resolve(hostname))
+        resolving[hostname] = task
+        task.add_done_callback(lambda _: resolving.pop(hostname, None))
+    addresses = await asyncio.shield(task)
+    dns_cache.set(hostname, addresses)
+    return addresses
+
+
+async def addresses(server: str) -> list:
+    """Addresses of a server given by address or name. Raises OSError if
+    it can't be resolved."""
+    ip = parse_address(server)
+    if ip is not None:
+        return [ip]
+    return await resolve(server)
+
+
+def forbidden_addresses(server: str, addresses: list) -> list:
+    """Addresses of a server that forbid mounting it."""
+    return policy.forbidden_addresses(server, addresses)
+
+
+def host(ip) -> str:
+    """An address as host of a mount source, IPv6 in brackets."""
+    return f"[{ip}]" if ip.version == 6 else str(ip)
@@ -0,0 +1,100 @@
+"""Native implementation of rclone obscure / rclone reveal.
+
+rclone obscures config values with AES-256 in CTR mode, a fixed key and
+a random IV. The result is the base64 (URL safe alphabet, no padding)
+encoded IV followed by the ciphertext. Only the AES encryption of a
+block is needed for CTR, so it's implemented here instead of adding a
+crypto dependency for a few bytes per mount.
+"""
+import base64
+import os
+
+# https://github.com/rclone/rclone/blob/master/fs/config/obscure/obscure.go
+crypt_key = bytes.fromhex(
+    "9c935b48730a554d6bfd7c63c886a92bd390198eb8128afbf4de162b8b95f638"
+)
+block_size = 16
+
+sbox = bytes.fromhex(
+    "637c777bf26b6fc53001672bfed7ab76ca82c97dfa5947f0add4a2af9ca472c0"
+    "b7fd9326363ff7cc34a5e5f171d8311504c723c31896059a071280e2eb27b275"
+    "09832c1a1b6e5aa0523bd6b329e32f8453d100ed20fcb15b6acbbe394a4c58cf"
+    "d0efaafb434d338545f9027f503c9fa851a3408f929d38f5bcb6da2110fff3d2"
+    "cd0c13ec5f974417c4a77e3d645d197360814fdc222a908846eeb814de5e0bdb"
+    "e0323a0a4906245cc2d3ac629195e479e7c8376d8dd54ea96c56f4ea657aae08"
+    "ba78252e1ca6b4c6e8dd741f4bbd8b8a703eb5664803f60e613557b986c11d9e"
+    "e1f8981169d98e949b1e87e9ce5528df8ca1890dbfe6426841992d0fb054bb16"
+)
+
+
+def _xtime(a: int) -> int:
+    a <<= 1
+    return (a ^ 0x1B) & 0xFF if a & 0x100 else a
+
+
+def _expand_key(key: bytes) -> list:
+    """AES-256 key schedule, returns the 15 round keys."""
+    nk, rounds = 8, 14
+    words = [list(key[4 * i : 4 * i + 4]) for i in range(nk)]
+    rcon = 1
+    for i in range(nk, 4 * (rounds + 1)):
+        word = list(words[i - 1])
+        if i % nk == 0:
+            word = [sbox[b] for b in word[1:] + word[:1]]
+            word[0] ^= rcon
+            rcon = _xtime(rcon)
+        elif i % nk == 4:
+            word = [sbox[b] for b in word]
+        words.append([a ^ b for a, b in zip(words[i - nk], word)])
+    return [sum(words[4 * r : 4 * r + 4], []) for r in range(rounds + 1)]
+
+
+round_keys = _expand_key(crypt_key)
+
+
+def _encrypt_block(block: bytes) -> bytes:
+    # The state is stored column by column: state[4 * column + row]
+    state = [b ^ k for b, k in zip(block, round_keys[0])]
+    for r in range(1, len(round_keys)):
+        # SubBytes and ShiftRows
+        state = [sbox[state[(i + 4 * (i % 4)) % 16]] for i in range(16)]
+        if r != len(round_keys) - 1:
+            mixed = []
+            for c in range(0, 16, 4):
+                a0, a1, a2, a3 = state[c : c + 4]
+                t = a0 ^ a1 ^ a2 ^ a3
+                mixed += [
+                    a0 ^ t ^ _xtime(a0 ^ a1),
+                    a1 ^ t ^ _xtime(a1 ^ a2),
+                    a2 ^ t ^ _xtime(a2 ^ a3),
+                    a3 ^ t ^ _xtime(a3 ^ a0),
+                ]
+            state = mixed
+        state = [b ^ k for b, k in zip(state, round_keys[r])]
+    return bytes(state)
+
+
+def _crypt(iv: bytes, data: bytes) -> bytes:
+    """AES-CTR, the IV is incremented as one big endian counter."""
+    counter = int.from_bytes(iv, "big")
+    out = bytearray()
+    for offset in range(0, len(data), block_size):
+        keystream = _encrypt_block(counter.to_bytes(block_size, "big"))
+        chunk = data[offset : offset + block_size]
+        out += bytes(a ^ b for a, b in zip(chunk, keystream))
+        counter = (counter + 1) % (1 << 128)
+    return bytes(out)
+
+
+def obscure(value: str, iv: bytes = None) -> str:
+    if iv is None:
+        iv = os.urandom(block_size)
+    ciphertext = _crypt(iv, value.encode())
+    return base64.urlsafe_b64encode(iv + ciphertext).decode().rstrip("=")
+
+
+def reveal(value: str) -> str:
+    data = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    if len(data) < block_size:
+        raise ValueError("input too short when revealing password - is it obscured?")
+    return _crypt(data[:block_size], data[block_size:]).decode()
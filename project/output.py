@@ -0,0 +1,197 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from log import getLogger
+
+buffer_lines = int(os.environ.get("MOUNT_OUTPUT_LINES", 1000))
+subscriber_queue_size = 1000
+log_file_poll_interval = 0.5
+# Log files of detached mount processes are truncated beyond this size
+log_file_max_size = int(os.environ.get("MOUNT_LOG_MAX_SIZE", 1024 * 1024))
+
+
+class OutputPump:
+    """Continuously reads stdout and stderr of a mount process.
+
+    Nothing else may read the process pipes. Lines are kept in a bounded
+    ring buffer, forwarded to the logger with the mount path attached and
+    handed to subscribers (e.g. a streaming logs request). A full pipe
+    would block the process in write(), so reading never waits on
+    consumers.
+    """
+
+    def __init__(self, path: str, process, maxlen: int = buffer_lines):
+        self.path = path
+        self.lines = deque(maxlen=maxlen)
+        self.subscribers = set()
+        self.closed = False
+        self.tasks = [
+            asyncio.create_task(self._pump(process.stdout, "stdout")),
+            asyncio.create_task(self._pump(process.stderr, "stderr")),
+        ]
+
+    async def _pump(self, stream, name: str):
+        log = getLogger()
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # Line longer than the stream limit, the buffer was discarded
+                line = b"[line too long, truncated]\n"
+            except Exception:
+                log.exception(f"Reading {name} of {self.path} failed")
+                break
+            if not line:
+                break
+            self._add(line, name)
+        if all(task.done() or task is asyncio.current_task() for task in self.tasks):
+            self._close()
+
+    def _add(self, line: bytes, name: str):
+        entry = {
+            "time": time.time(),
+            "stream": name,
+            "line": line.decode(errors="replace").rstrip("\n"),
+        }
+        self.lines.append(entry)
+        getLogger().debug(
+            entry["line"], extra={"mount_path": self.path, "output": name}
+        )
+        self._publish(entry)
+
+    def _close(self):
+        self.closed = True
+        self._publish(None)
+
+    def _publish(self, entry):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                # Slow consumers lose lines, the process must never block
+                pass
+
+    async def wait_closed(self):
+        await asyncio.gather(*self.tasks)
+
+    def text(self, stream: str = None) -> str:
+        return "\n".join(
+            entry["line"]
+            for entry in self.lines
+            if stream is None or entry["stream"] == stream
+        )
+
+    def subscribe(self):
+        """Returns a queue receiving all new lines, None once closed."""
+        queue = asyncio.Queue(maxsize=subscriber_queue_size)
+        self.subscribers.add(queue)
+        if self.closed:
+            queue.put_nowait(None)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+
+class LogFileOutput(OutputPump):
+    """OutputPump for a process writing stdout and stderr into a log file.
+
+    Unlike pipes, the file stays writable when this process exits, so the
+    mount process can outlive it and be reattached (see journal.py). The
+    file is polled for new lines, both streams are reported as "output".
+    Once it's read past log_file_max_size it's truncated, the process
+    appends to it and continues at the start.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        log_file: str,
+        process,
+        from_end: bool = False,
+        maxlen: int = buffer_lines,
+    ):
+        self.path = path
+        self.log_file = log_file
+        self.lines = deque(maxlen=maxlen)
+        self.subscribers = set()
+        self.closed = False
+        self.tasks = [asyncio.create_task(self._tail(process, from_end))]
+
+    async def _tail(self, process, from_end: bool):
+        try:
+            with open(self.log_file, "rb") as f:
+                if from_end:
+                    f.seek(0, os.SEEK_END)
+                partial = b""
+                while True:
+                    # Checked before reading, to get what's written right
+                    # before the exit
+                    exited = process is None or process.returncode is not None
+                    data = f.read()
+                    if data:
+                        *lines, partial = (partial + data).split(b"\n")
+                        for line in lines:
+                            self._add(line, "output")
+                        if f.tell() > log_file_max_size:
+                            os.truncate(self.log_file, 0)
+                            f.seek(0)
+                    elif exited:
+                        if partial:
+                            self._add(partial, "output")
+                        break
+                    else:
+                        await asyncio.sleep(log_file_poll_interval)
+        except Exception:
+            getLogger().exception(f"Reading {self.log_file} of {self.path} failed")
+        self._close()
+
+    def text(self, stream: str = None) -> str:
+        return super().text(None)
+
+
+def log_file_entry(line: bytes) -> dict:
+    return {
+        "time": time.time(),
+        "stream": "output",
+        "line": line.decode(errors="replace").rstrip("\n"),
+    }
+
+
+def read_log_file(log_file: str, maxlen: int = buffer_lines):
+    """Last lines of a log file and the offset they end at, for mounts of
+    other workers, whose OutputPump lives in the other process."""
+    try:
+        with open(log_file, "rb") as f:
+            lines = deque(f, maxlen=maxlen)
+            offset = f.tell()
+    except FileNotFoundError:
+        return [], 0
+    return [log_file_entry(line) for line in lines], offset
+
+
+async def follow_log_file(log_file: str, offset: int, process):
+    """Yields the lines written to a log file after offset, until the
+    process has exited."""
+    with open(log_file, "rb") as f:
+        f.seek(offset)
+        partial = b""
+        while True:
+            exited = process is None or process.returncode is not None
+            data = f.read()
+            if data:
+                *lines, partial = (partial + data).split(b"\n")
+                for line in lines:
+                    yield log_file_entry(line)
+            elif exited:
+                if partial:
+                    yield log_file_entry(partial)
+                return
+            else:
+                if os.fstat(f.fileno()).st_size < f.tell():
+                    # Truncated by the LogFileOutput of the owner
+                    f.seek(0)
+                    partial = b""
+                await asyncio.sleep(log_file_poll_interval)
@@ -0,0 +1,166 @@
+import json
+import os
+import re
+from copy import deepcopy
+
+from log import getLogger
+from values import profiles_path
+
+size_re = re.compile(r"^(off|\d+(\.\d+)?([bkmgtp](i?b)?)?)$", re.IGNORECASE)
+duration_re = re.compile(r"^(off|\d+|(\d+(\.\d+)?(ns|us|ms|s|m|h|d|w|M|y))+)$")
+
+
+def _size(value):
+    return isinstance(value, str) and size_re.match(value) is not None
+
+
+def _duration(value):
+    return isinstance(value, str) and duration_re.match(value) is not None
+
+
+def _int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _bool(value):
+    return isinstance(value, bool)
+
+
+def _cache_mode(value):
+    return value in ["off", "minimal", "writes", "full"]
+
+
+# Supported rclone mount flags with their validator and the option name
+# used by the rc API: (block, name), block being vfsOpt, mountOpt or
+# _config for global options
+flags = {
+    "vfs-cache-mode": (_cache_mode, ("vfsOpt", "CacheMode")),
+    "vfs-read-chunk-size": (_size, ("vfsOpt", "ChunkSize")),
+    "vfs-read-chunk-size-limit": (_size, ("vfsOpt", "ChunkSizeLimit")),
+    "vfs-read-chunk-streams": (_int, ("vfsOpt", "ChunkStreams")),
+    "vfs-read-ahead": (_size, ("vfsOpt", "ReadAhead")),
+    "vfs-cache-max-age": (_duration, ("vfsOpt", "CacheMaxAge")),
+    "vfs-write-back": (_duration, ("vfsOpt", "WriteBack")),
+    "vfs-fast-fingerprint": (_bool, ("vfsOpt", "FastFingerprint")),
+    "dir-cache-time": (_duration, ("vfsOpt", "DirCacheTime")),
+    "poll-interval": (_duration, ("vfsOpt", "PollInterval")),
+    "no-modtime": (_bool, ("vfsOpt", "NoModTime")),
+    "attr-timeout": (_duration, ("mountOpt", "AttrTimeout")),
+    "async-read": (_bool, ("mountOpt", "AsyncRead")),
+    "buffer-size": (_size, ("_config", "BufferSize")),
+    "transfers": (_int, ("_config", "Transfers")),
+    "checkers": (_int, ("_config", "Checkers")),
+}
+
+default_profiles = {
+    "default": {
+        "vfs-cache-mode": "writes",
+        "vfs-read-chunk-size": "64M",
+    },
+    "streaming-read": {
+        "vfs-cache-mode": "full",
+        "vfs-read-chunk-size": "128M",
+        "vfs-read-ahead": "256M",
+        "buffer-size": "64M",
+    },
+    "small-files": {
+        "vfs-cache-mode": "writes",
+        "vfs-read-chunk-size": "16M",
+        "buffer-size": "4M",
+        "dir-cache-time": "30m",
+        "attr-timeout": "10s",
+        "transfers": 16,
+        "checkers": 16,
+    },
+    "write-heavy": {
+        "vfs-cache-mode": "writes",
+        "vfs-write-back": "10s",
+        "buffer-size": "16M",
+        "transfers": 8,
+    },
+}
+
+# Applied on top of the default profile, keyed by config.type or
+# "<type>:<vendor>" (the latter wins)
+default_backends = {
+    "s3": {"transfers": 8, "buffer-size": "32M", "dir-cache-time": "10m"},
+    "webdav": {"transfers": 4, "dir-cache-time": "1m"},
+    "webdav:nextcloud": {"dir-cache-time": "5m"},
+    "sftp": {"transfers": 4, "buffer-size": "16M", "dir-cache-time": "5m"},
+    "b2": {"transfers": 16, "buffer-size": "64M", "vfs-read-chunk-size": "96M"},
+    "drive": {"transfers": 4, "dir-cache-time": "1000h", "poll-interval": "1m"},
+}
+
+profiles = deepcopy(default_profiles)
+backends = deepcopy(default_backends)
+
+
+def validate_flags(name: str, profile: dict):
+    if not isinstance(profile, dict):
+        raise Exception(f"Profile {name} must be an object")
+    for flag, value in profile.items():
+        if flag not in flags:
+            raise Exception(f"Profile {name}: flag {flag} not supported")
+        if not flags[flag][0](value):
+            raise Exception(f"Profile {name}: invalid value {value} for {flag}")
+
+
+def load():
+    """Reads the profiles file on top of the default profiles.
+
+    Raises if a profile is invalid, so broken profiles are noticed at
+    startup and not on the first mount using them.
+    """
+    global profiles
+    global backends
+    log = getLogger()
+    new_profiles = deepcopy(default_profiles)
+    new_backends = deepcopy(default_backends)
+    if os.path.exists(profiles_path):
+        log.info(f"Load profiles from {profiles_path} ...")
+        with open(profiles_path) as f:
+            config = json.load(f)
+        new_profiles.update(config.get("profiles", {}))
+        new_backends.update(config.get("backends", {}))
+    for name, profile in new_profiles.items():
+        validate_flags(name, profile)
+    for name, profile in new_backends.items():
+        validate_flags(name, profile)
+    profiles = new_profiles
+    backends = new_backends
+
+
+def resolve(item) -> dict:
+    """Name and merged flags of the profile used by a mount. Later ones
+    win: default profile, backend type, backend type and vendor, the
+    profile requested in options.profile."""
+    type_ = item.options.config.get("type", None)
+    vendor_ = item.options.config.get("vendor", None)
+    name = item.options.profile or "default"
+    if name not in profiles:
+        raise Exception(f"Profile {name} not found")
+    resolved = dict(profiles["default"])
+    resolved.update(backends.get(type_, {}))
+    resolved.update(backends.get(f"{type_}:{vendor_}", {}))
+    if name != "default":
+        resolved.update(profiles[name])
+    return {"name": name, "flags": resolved}
+
+
+def to_args(profile_flags: dict) -> list:
+    """Flags as rclone mount command line arguments."""
+    args = []
+    for flag, value in profile_flags.items():
+        if isinstance(value, bool):
+            value = str(value).lower()
+        args.append(f"--{flag}={value}")
+    return args
+
+
+def to_rc_options(profile_flags: dict) -> dict:
+    """Flags as option blocks of the rc mount/mount call."""
+    options = {"vfsOpt": {}, "mountOpt": {}, "_config": {}}
+    for flag, value in profile_flags.items():
+        block, name = flags[flag][1]
+        options[block][name] = value
+    return options
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import os
+import secrets
+
+import httpx
+import vfs_cache
+from log import getLogger
+from output import OutputPump
+from values import config_store_dir
+
+# "process" spawns one rclone mount per mount, "rcd" drives all rclone
+# mounts through a single rclone rcd daemon and its remote control API
+enabled = os.environ.get("RCLONE_BACKEND", "process") == "rcd"
+rc_addr = os.environ.get("RCLONE_RC_ADDR", "127.0.0.1:53682")
+rc_timeout = float(os.environ.get("RCLONE_RC_TIMEOUT", 60))
+rcd_config_path = os.environ.get(
+    "RCLONE_RCD_CONFIG", os.path.join(config_store_dir, "rcd.conf")
+)
+
+process = None
+output = None
+client = None
+
+
+class RCError(Exception):
+    pass
+
+
+def cache_dirs(name: str) -> list:
+    """VFS cache directories of a remote of the daemon."""
+    cache_dir = os.path.join(vfs_cache.cache_dir, "rcd")
+    return [
+        os.path.join(cache_dir, "vfs", name),
+        os.path.join(cache_dir, "vfsMeta", name),
+    ]
+
+
+def remote_name(path: str) -> str:
+    """Name of the remote a mount's config is stored under in the daemon."""
+    return f"datamount-{hashlib.sha256(path.encode()).hexdigest()[:16]}"
+
+
+async def start(timeout: float = 30.0):
+    global process
+    global output
+    global client
+    log = getLogger()
+    log.info(f"Start rclone rcd on {rc_addr} ...")
+    user = secrets.token_urlsafe(16)
+    password = secrets.token_urlsafe(32)
+    cmd = [
+        "rclone",
+        "rcd",
+        f"--rc-addr={rc_addr}",
+        "--config",
+        rcd_config_path,
+    ]
+    if vfs_cache.enabled():
+        cmd.append(f"--cache-dir={os.path.join(vfs_cache.cache_dir, 'rcd')}")
+    os.makedirs(os.path.dirname(rcd_config_path), mode=0o700, exist_ok=True)
+    # Credentials in the environment, the command line is readable for
+    # every user
+    env = {**os.environ, "RCLONE_RC_USER": user, "RCLONE_RC_PASS": password}
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env
+    )
+    output = OutputPump("rclone-rcd", process)
+    client = httpx.AsyncClient(
+        base_url=f"http://{rc_addr}",
+        auth=(user, password),
+        timeout=rc_timeout,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+    )
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        if process.returncode is not None:
+            await output.wait_closed()
+            raise RuntimeError(
+                f"rclone rcd exited with code {process.returncode}:\n{output.text('stderr').strip()}"
+            )
+        try:
+            await call("rc/noop")
+            break
+        except httpx.TransportError:
+            if loop.time() > deadline:
+                await stop()
+                raise RuntimeError(f"rclone rcd not reachable after {timeout} seconds")
+            await asyncio.sleep(0.1)
+    log.info(f"Start rclone rcd on {rc_addr} ... successful")
+
+
+async def stop():
+    global process
+    global client
+    if client:
+        await client.aclose()
+        client = None
+    if process and process.returncode is None:
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+    process = None
+    try:
+        os.remove(rcd_config_path)
+    except FileNotFoundError:
+        pass
+
+
+async def call(method: str, **params) -> dict:
+    """Calls a remote control method and returns its JSON output."""
+    response = await client.post(f"/{method}", json=params)
+    try:
+        output = response.json()
+    except ValueError:
+        output = {"error": response.text}
+    if response.status_code != 200:
+        raise RCError(output.get("error", f"{method} failed ({response.status_code})"))
+    return output
+
+
+async def create_remote(name: str, type_: str, parameters: dict):
+    # Values of obscure_* keys are obscured by utils.create_config already
+    await call(
+        "config/create",
+        name=name,
+        type=type_,
+        parameters=parameters,
+        opt={"nonInteractive": True, "obscure": False, "noObscure": True},
+    )
+
+
+async def delete_remote(name: str):
+    await call("config/delete", name=name)
+
+
+async def list_dirs(fs: str, remote: str) -> dict:
+    return await call("operations/list", fs=fs, remote=remote, opt={"dirsOnly": True})
+
+
+async def mount(
+    fs: str, mountpoint: str, mount_opt: dict, vfs_opt: dict, config: dict = None
+):
+    params = {
+        "fs": fs,
+        "mountPoint": mountpoint,
+        "mountOpt": mount_opt,
+        "vfsOpt": vfs_opt,
+    }
+    if config:
+        # Global options like transfers, applied to this call only
+        params["_config"] = config
+    await call("mount/mount", **params)
+
+
+async def unmount(mountpoint: str):
+    await call("mount/unmount", mountPoint=mountpoint)
@@ -0,0 +1,267 @@
+"""Registry of the mounts and the locks serializing work on a path.
+
+By default everything is kept in process memory, which is only correct
+with a single worker. With SHARED_REGISTRY=true the records live in a
+SQLite database (WAL mode) and path locks are file locks, both in the
+config store, so several gunicorn workers can serve the same mounts.
+Process specific state (process objects, output pumps) stays in
+utils.mounts of the worker owning the mount.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import metrics
+from log import getLogger
+from values import config_store_dir
+from values import job_ttl
+from values import registry_path
+from values import shared_registry
+
+lock_dir = os.path.join(config_store_dir, "locks")
+lock_poll_interval = 0.01
+lock_poll_max_interval = 0.1
+
+# path -> record, used without a shared registry
+records = {}
+path_locks = {}
+# path -> number of tasks holding or waiting for its lock
+path_lock_users = {}
+connection = None
+connection_pid = None
+thread = None
+thread_pid = None
+
+
+def owner_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def db():
+    """Connection of this process, workers forked from a preloaded app
+    must not share the one of the parent."""
+    global connection
+    global connection_pid
+    if connection is None or connection_pid != os.getpid():
+        os.makedirs(os.path.dirname(registry_path), mode=0o700, exist_ok=True)
+        connection = sqlite3.connect(registry_path, timeout=10, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS mounts "
+            "(path TEXT PRIMARY KEY, owner INTEGER, record TEXT)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs "
+            "(id TEXT PRIMARY KEY, state TEXT, updated REAL)"
+        )
+        os.chmod(registry_path, 0o600)
+        connection_pid = os.getpid()
+    return connection
+
+
+def db_thread():
+    """Thread running the SQLite calls of this process, one at a time and
+    in order. A call waits for up to the busy timeout while another
+    worker writes, that must not block the event loop."""
+    global thread
+    global thread_pid
+    if thread is None or thread_pid != os.getpid():
+        thread = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="registry"
+        )
+        thread_pid = os.getpid()
+    return thread
+
+
+async def execute(sql: str, parameters: tuple = ()):
+    """Runs a statement on the registry thread, returns the rows and the
+    row count."""
+
+    def run():
+        cursor = db().execute(sql, parameters)
+        return cursor.fetchall(), cursor.rowcount
+
+    return await asyncio.get_running_loop().run_in_executor(db_thread(), run)
+
+
+class SharedPathLock:
+    """Serializes work on a path across tasks and processes. An asyncio
+    lock orders the tasks of this process, a flock() the processes.
+    flock() is polled non-blocking, so waiting never blocks the event
+    loop and can be cancelled."""
+
+    def __init__(self, path: str):
+        self.local = metrics.TimedLock("path")
+        name = hashlib.sha256(path.encode()).hexdigest()[:16]
+        self.lock_path = os.path.join(lock_dir, f"{name}.lock")
+        self.fd = None
+
+    async def __aenter__(self):
+        await self.local.acquire()
+        try:
+            os.makedirs(lock_dir, mode=0o700, exist_ok=True)
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            interval = lock_poll_interval
+            start = time.perf_counter()
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(interval)
+                    interval = min(interval * 2, lock_poll_max_interval)
+                except:
+                    os.close(fd)
+                    raise
+            metrics.lock_wait.labels("path_file").observe(time.perf_counter() - start)
+            self.fd = fd
+        except:
+            self.local.release()
+            raise
+        return self
+
+    async def __aexit__(self, *args):
+        fd, self.fd = self.fd, None
+        # Closing the file releases the flock
+        os.close(fd)
+        self.local.release()
+
+
+@contextlib.asynccontextmanager
+async def path_lock(path: str):
+    """Serializes mount / unmount calls for one path. The lock is
+    dropped once it's released and no other task waits for it."""
+    if path not in path_locks:
+        if shared_registry:
+            path_locks[path] = SharedPathLock(path)
+        else:
+            path_locks[path] = metrics.TimedLock("path")
+    path_lock_users[path] = path_lock_users.get(path, 0) + 1
+    try:
+        async with path_locks[path]:
+            yield
+    finally:
+        path_lock_users[path] -= 1
+        if not path_lock_users[path]:
+            del path_lock_users[path]
+            del path_locks[path]
+
+
+async def add(path: str, record: dict):
+    if not shared_registry:
+        records[path] = dict(record, owner=os.getpid())
+        return
+    await execute(
+        "INSERT OR REPLACE INTO mounts (path, owner, record) VALUES (?, ?, ?)",
+        (path, os.getpid(), json.dumps(record, default=str)),
+    )
+
+
+async def remove(path: str, owner: int = None):
+    """Removes a record, only if it's owned by owner if given."""
+    if owner is None:
+        owner = os.getpid()
+    if not shared_registry:
+        if records.get(path, {}).get("owner", None) == owner:
+            del records[path]
+        return
+    await execute("DELETE FROM mounts WHERE path = ? AND owner = ?", (path, owner))
+
+
+async def get(path: str):
+    """Record of a mount with the pid of its owner as "owner"."""
+    if not shared_registry:
+        return records.get(path, None)
+    rows, _ = await execute("SELECT owner, record FROM mounts WHERE path = ?", (path,))
+    if not rows:
+        return None
+    owner, record = rows[0]
+    return dict(json.loads(record), owner=owner)
+
+
+async def owns(path: str, pid) -> bool:
+    """Whether the record of a path is this worker's mount run by the
+    process pid (None for mounts without a process)."""
+    record = await get(path)
+    return (
+        record is not None
+        and record["owner"] == os.getpid()
+        and record.get("pid", None) == pid
+    )
+
+
+async def all() -> dict:
+    if not shared_registry:
+        return dict(records)
+    rows, _ = await execute("SELECT path, owner, record FROM mounts")
+    return {path: dict(json.loads(record), owner=owner) for path, owner, record in rows}
+
+
+async def orphans() -> dict:
+    """Records whose owning worker is gone."""
+    return {
+        path: record
+        for path, record in (await all()).items()
+        if record["owner"] != os.getpid() and not owner_alive(record["owner"])
+    }
+
+
+async def claim(path: str, previous_owner: int) -> bool:
+    """Takes over a record from previous_owner, a gone worker or one
+    whose mount is unmounted. False if another worker was faster."""
+    if not shared_registry:
+        return False
+    _, count = await execute(
+        "UPDATE mounts SET owner = ? WHERE path = ? AND owner = ?",
+        (os.getpid(), path, previous_owner),
+    )
+    return count == 1
+
+
+def _save_job(job_id: str, state: str, expire: bool):
+    try:
+        if expire:
+            db().execute("DELETE FROM jobs WHERE updated < ?", (time.time() - job_ttl,))
+        db().execute(
+            "INSERT OR REPLACE INTO jobs (id, state, updated) VALUES (?, ?, ?)",
+            (job_id, state, time.time()),
+        )
+    except sqlite3.Error:
+        getLogger().exception(f"Saving job {job_id} failed")
+
+
+def save_job(state: dict):
+    """Queued on the registry thread without waiting for it, statements
+    run in order, so a later get_job sees it."""
+    if not shared_registry:
+        return
+    db_thread().submit(
+        _save_job,
+        state["id"],
+        json.dumps(state, default=str),
+        # Expire old jobs whenever a new one starts
+        state["status"] == "queued",
+    )
+
+
+async def get_job(job_id: str):
+    if not shared_registry:
+        return None
+    rows, _ = await execute(
+        "SELECT state FROM jobs WHERE id = ? AND updated > ?",
+        (job_id, time.time() - job_ttl),
+    )
+    return json.loads(rows[0][0]) if rows else None
@@ -0,0 +1,153 @@
+"""Span style tracing of the mount lifecycle.
+
+Disabled by default, span() then returns a shared no-op context manager.
+TRACING_EXPORTER=file writes finished spans as JSON lines in the shape
+of OTLP/JSON spans to TRACING_FILE. TRACING_EXPORTER=otlp hands them to
+the OpenTelemetry SDK, which has to be installed, configured via the
+usual OTEL_EXPORTER_OTLP_* variables.
+"""
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextlib import nullcontext
+
+from log import getLogger
+
+exporter = os.environ.get("TRACING_EXPORTER", "none")
+trace_file = os.environ.get("TRACING_FILE", "/tmp/datamount-traces.jsonl")
+service_name = os.environ.get("TRACING_SERVICE_NAME", "jupyterlab-data-mount-api")
+
+noop = nullcontext()
+current_span = contextvars.ContextVar("current_span", default=None)
+enabled = False
+otel_provider = None
+otel_tracer = None
+trace_output = None
+trace_output_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict):
+        parent = current_span.get()
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else ""
+        self.attributes = attributes
+        self.events = []
+        self.status = {"code": "STATUS_CODE_UNSET"}
+        self.start = time.time_ns()
+        self.end = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: dict = None):
+        self.events.append(
+            {
+                "name": name,
+                "timeUnixNano": time.time_ns(),
+                "attributes": attributes or {},
+            }
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start,
+            "endTimeUnixNano": self.end,
+            "attributes": self.attributes,
+            "events": self.events,
+            "status": self.status,
+            "resource": {"service.name": service_name},
+        }
+
+
+@contextmanager
+def file_span(name: str, attributes: dict):
+    span = Span(name, attributes)
+    token = current_span.set(span)
+    try:
+        yield span
+        span.status = {"code": "STATUS_CODE_OK"}
+    except BaseException as e:
+        span.status = {"code": "STATUS_CODE_ERROR", "message": repr(e)}
+        raise
+    finally:
+        span.end = time.time_ns()
+        current_span.reset(token)
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with trace_output_lock:
+            if not trace_output.closed:
+                trace_output.write(line)
+
+
+def span(name: str, **attributes):
+    """Context manager tracing a stage. Yields the span (None when
+    tracing is disabled), which offers set_attribute and add_event."""
+    if not enabled:
+        return noop
+    if otel_tracer is not None:
+        return otel_tracer.start_as_current_span(name, attributes=attributes)
+    return file_span(name, attributes)
+
+
+def setup():
+    global enabled
+    global otel_provider
+    global otel_tracer
+    global trace_output
+    log = getLogger()
+    if exporter == "file":
+        trace_output = open(trace_file, "a", buffering=1)
+        enabled = True
+    elif exporter == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError:
+            log.exception("TRACING_EXPORTER=otlp requires opentelemetry-sdk")
+            return
+        otel_provider = TracerProvider(
+            resource=Resource.create({"service.name": service_name})
+        )
+        otel_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        otel_tracer = otel_provider.get_tracer("datamount")
+        enabled = True
+    if enabled:
+        log.info(f"Tracing enabled, exporter: {exporter}")
+
+
+def shutdown():
+    global enabled
+    enabled = False
+    if otel_provider is not None:
+        otel_provider.shutdown()
+    if trace_output is not None:
+        with trace_output_lock:
+            trace_output.close()
+
+
+def add_event(name: str, **attributes):
+    """Adds an event, like a spawned subprocess, to the current span."""
+    if not enabled:
+        return
+    if otel_tracer is not None:
+        from opentelemetry import trace
+
+        trace.get_current_span().add_event(name, attributes)
+        return
+    span = current_span.get()
+    if span is not None:
+        span.add_event(name, attributes)
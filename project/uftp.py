@@ -1,13 +1,36 @@
+import asyncio
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+import fsops
 import pyunicore.client as uc_client
 import pyunicore.credentials as uc_credentials
 import pyunicore.uftp.uftp as uc_uftp
+import requests
+import tracing
+from cache import TTLCache
 from models import DataMountModel
 from values import base_mount_dir
 from values import gid
 from values import uid
 
+fusedriver = os.environ.get(
+    "UFTP_FUSEDRIVER", "/opt/datamount_venv/bin/unicore-fusedriver"
+)
+# Authentication is a blocking network round trip, keep it off the event loop
+auth_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("UFTP_AUTH_WORKERS", 4)),
+    thread_name_prefix="uftp-auth",
+)
+# (host, port, secret) of persistent UFTP sessions, reused by remounts
+auth_cache = TTLCache(
+    maxsize=int(os.environ.get("UFTP_AUTH_CACHE_SIZE", 256)),
+    ttl=float(os.environ.get("UFTP_AUTH_CACHE_TTL", 60)),
+)
+# requests.Session per auth_url
+sessions = {}
+
 
 def validate(item: DataMountModel):
     if not item.options.config.get("access_token", None):
@@ -25,30 +48,95 @@ def validate(item: DataMountModel):
     return True, None
 
 
-def cmd(item: DataMountModel):
-    validation, description = validate(item)
-    if not validation:
-        return validation, description
-
+def authentication_key(item: DataMountModel):
     access_token = item.options.config["access_token"]
-    cred = uc_credentials.OIDCToken(access_token, None)
-    _auth = item.options.config["auth_url"]
+    return (
+        hashlib.sha256(access_token.encode()).hexdigest(),
+        item.options.config["auth_url"],
+        base_dir(item),
+        preferences(item),
+    )
+
 
+def base_dir(item: DataMountModel):
     if item.options.config.get("remotepath", "/") == "__custom__path__":
-        _base_dir = item.options.config.get("custompath", "/")
-    else:
-        _base_dir = item.options.config.get("remotepath", "/")
-    uc_client.Transport(credential=cred, verify=False, timeout=30)
+        return item.options.config.get("custompath", "/")
+    return item.options.config.get("remotepath", "/")
+
+
+def preferences(item: DataMountModel):
     pref_list = []
     if "uid" in item.options.config.keys():
         pref_list.append(f"uid:{item.options.config['uid']}")
     if "group" in item.options.config.keys():
         pref_list.append(f"group:{item.options.config['group']}")
-    preferences = ",".join(pref_list)
-    _host, _port, _password = uc_uftp.UFTP().authenticate(
-        cred, _auth, _base_dir, preferences=preferences if preferences else None
-    )
-    cmd = ["/opt/datamount_venv/bin/unicore-fusedriver", "-d"]
+    return ",".join(pref_list)
+
+
+def get_session(auth_url: str):
+    if auth_url not in sessions:
+        sessions[auth_url] = requests.Session()
+    return sessions[auth_url]
+
+
+class PooledTransport(uc_client.Transport):
+    """Transport sending its requests through a shared requests.Session,
+    so connections to the auth server are reused across mounts."""
+
+    def __init__(self, credential, session, **kwargs):
+        super().__init__(credential, **kwargs)
+        self.session = session
+
+    def post(self, **kwargs):
+        return self.run_method(self.session.post, **kwargs)
+
+
+def authenticate(access_token, auth_url, session, _base_dir, _preferences):
+    """Same request as pyunicore's UFTP.authenticate, which would clone the
+    transport and therefore drop the pooled session. Blocking."""
+    cred = uc_credentials.OIDCToken(access_token, None)
+    transport = PooledTransport(cred, session, verify=False, timeout=30)
+    if _base_dir != "" and not _base_dir.endswith("/"):
+        _base_dir += "/"
+    if _preferences:
+        transport.preferences = _preferences
+    req = {
+        "serverPath": _base_dir + uc_uftp.UFTP.uftp_session_tag,
+        "persistent": "true",
+    }
+    params = transport.post(url=auth_url, json=req).json()
+    return params["serverHost"], params["serverPort"], params["secret"]
+
+
+def forget(item: DataMountModel):
+    """Drops a cached authentication, e.g. after the mount failed with it."""
+    auth_cache.pop(authentication_key(item))
+
+
+async def cmd(item: DataMountModel):
+    validation, description = validate(item)
+    if not validation:
+        return validation, description
+
+    key = authentication_key(item)
+    auth = auth_cache.get(key)
+    if auth is None:
+        _auth = item.options.config["auth_url"]
+        with tracing.span("uftp.authenticate", auth_url=_auth):
+            auth = await asyncio.get_running_loop().run_in_executor(
+                auth_executor,
+                authenticate,
+                item.options.config["access_token"],
+                _auth,
+                get_session(_auth),
+                base_dir(item),
+                preferences(item),
+            )
+        auth_cache.set(key, auth)
+    else:
+        tracing.add_event("uftp.authenticate cached")
+    _host, _port, _password = auth
+    cmd = [fusedriver, "-d"]
     if item.options.readonly:
         cmd.append("-r")
     cmd.extend(["-P", _password])
@@ -56,10 +144,6 @@ def cmd(item: DataMountModel):
     cmd.extend(["--fuse-options", f"uid={uid},gid={gid},allow_other"])
     fullpath = os.path.join(base_mount_dir, item.path)
     cmd.append(fullpath)
-    if not os.path.exists(fullpath):
-        os.makedirs(fullpath, exist_ok=True)
-        os.chown(fullpath, uid, gid)
-    if os.path.isdir(fullpath):
-        if os.listdir(fullpath):
-            raise Exception(f"Directory {item.path} is not empty.")
+    with tracing.span("uftp.prepare_mountpoint"):
+        await fsops.prepare_mountpoint(fullpath, item.path)
     return cmd
@@ -1,20 +1,67 @@
 import asyncio
+import hashlib
 import json
 import os
-import tempfile
+import re
+import shutil
+import subprocess
+import time
 from copy import deepcopy
 
-import uftp
+import config_store
+import fsops
+import jobs
+import journal
+import metrics
+import mountinfo
 import nfs
+import obscure as _obscure
+import profiles
+import rcd
+import registry
+import tracing
+import uftp
+import vfs_cache
+from cache import TTLCache
 from log import getLogger
 from models import DataMountModel
+from output import LogFileOutput
+from output import OutputPump
 from values import base_mount_dir
 from values import gid
+from values import init_mounts_parallelism
+from values import init_mounts_path
+from values import init_mounts_timeout
+from values import max_concurrent_mounts
+from values import mount_ready_timeout
+from values import native_obscure
+from values import preflight_cache_negative_ttl
+from values import preflight_cache_size
+from values import preflight_cache_ttl
+from values import rclone_config_mode
+from values import shared_registry
+from values import shutdown_timeout
+from values import stop_grace_period
 from values import uid
 
-lock = asyncio.Lock()
+# Guards the mounts registry only. Never hold it while waiting for a
+# subprocess, use the per path locks for that.
+lock = metrics.TimedLock("registry")
+mount_semaphore = metrics.TimedSemaphore(max_concurrent_mounts, "mount_semaphore")
 background_tasks = set()
 mounts = {}
+# Obscured values by digest of the plain value
+obscure_cache = TTLCache(maxsize=256)
+# Results of config checks, None for a working config
+preflight_cache = TTLCache(maxsize=preflight_cache_size, ttl=preflight_cache_ttl)
+# Config checks in progress by preflight_key
+preflight_checks = {}
+# path -> "pending", "ready" or "failed"
+init_mounts_state = {}
+# path -> entry of the init mounts file, as last loaded
+init_mounts_config = {}
+# Paths the routes of the API would shadow, e.g. DELETE /batch
+reserved_paths = ["batch", "jobs"]
 
 
 def get_lock():
@@ -22,11 +69,40 @@ def get_lock():
     return lock
 
 
+def get_path_lock(path: str):
+    """Returns the lock serializing mount / unmount calls for one path,
+    to be used with async with."""
+    return registry.path_lock(path)
+
+
+def get_mount_semaphore():
+    global mount_semaphore
+    return mount_semaphore
+
+
 def get_mounts():
     global mounts
     return mounts
 
 
+def detached() -> bool:
+    """Whether mount processes must be able to outlive this process, to
+    be taken over by a restarted instance or another worker."""
+    return journal.enabled() or shared_registry
+
+
+def get_processes():
+    """Running processes by mount path, the rclone rcd as "rcd"."""
+    processes = {
+        path: entry["process"]
+        for path, entry in list(mounts.items())
+        if entry["process"] and entry["process"].returncode is None
+    }
+    if rcd.process and rcd.process.returncode is None:
+        processes["rcd"] = rcd.process
+    return processes
+
+
 def type_specific_args(item: DataMountModel):
     type_ = item.options.config.get("type", None)
     vendor_ = item.options.config.get("vendor", None)
@@ -41,11 +117,32 @@ def type_specific_args(item: DataMountModel):
 
 
 async def obscure(value: str):
+    start = time.perf_counter()
+    method = "cached"
+    key = hashlib.sha256(value.encode()).hexdigest()
+    obscured = obscure_cache.get(key)
+    if obscured is None:
+        if native_obscure:
+            method = "native"
+            try:
+                obscured = _obscure.obscure(value)
+            except Exception:
+                getLogger().exception("Native obscure failed, use rclone obscure")
+        if obscured is None:
+            method = "rclone"
+            obscured = await rclone_obscure(value)
+        obscure_cache.set(key, obscured)
+    metrics.obscure_duration.labels(method).observe(time.perf_counter() - start)
+    return obscured
+
+
+async def rclone_obscure(value: str):
     process = await asyncio.create_subprocess_exec(
         *["rclone", "obscure", value],
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
     )
+    tracing.add_event("subprocess", executable="rclone obscure", pid=process.pid)
     stdout, _ = await process.communicate()
     stdout = stdout.decode().strip()
     return stdout
@@ -54,6 +151,8 @@ async def obscure(value: str):
 def validate(item: DataMountModel):
     if not item.path:
         raise Exception("path not provided")
+    if os.path.normpath(item.path) in reserved_paths:
+        raise Exception(f"path {item.path} is reserved")
     if not item.options.template:
         raise Exception("options.template not provided")
     if item.options.template == "nfs":
@@ -69,89 +168,181 @@ def validate(item: DataMountModel):
             raise Exception("options.config.type not provided")
         if not item.options.config.get("remotepath", None):
             raise Exception("options.config.remotepath not provided")
+        profiles.resolve(item)
 
 
-def get_cmd(item: DataMountModel, config_path: str):
-    template = item.options.template
+def backend_parameters(item: DataMountModel):
+    """type_specific_args as config parameters of the remote."""
+    prefix = f"--{item.options.config.get('type', None)}-"
+    parameters = {}
+    for arg in type_specific_args(item):
+        if arg.startswith(prefix):
+            key, _, value = arg[len(prefix) :].partition("=")
+            parameters[key.replace("-", "_")] = value
+    return parameters
+
+
+async def prepare_mountpoint(path: str):
+    fullpath = os.path.join(base_mount_dir, path)
+    await fsops.prepare_mountpoint(fullpath, path)
+    return fullpath
+
+
+async def get_cmd(item: DataMountModel, rclone_config: dict):
     path = item.path
     remotepath = item.options.config.get("remotepath", "None")
-    fullpath = os.path.join(base_mount_dir, path)
-    if not os.path.exists(fullpath):
-        os.makedirs(fullpath, exist_ok=True)
-        os.chown(fullpath, uid, gid)
-    if os.path.isdir(fullpath):
-        if os.listdir(fullpath):
-            raise Exception(f"Directory {path} is not empty.")
-    cmd_args = [
-        "--vfs-cache-max-size=10G",
-        "--vfs-read-chunk-size=64M",
-        "--vfs-cache-mode=writes",
+    fullpath = await prepare_mountpoint(path)
+    profile = profiles.resolve(item)
+    cmd_args = await vfs_cache.args(path, item.options.cache_weight)
+    cmd_args += profiles.to_args(profile["flags"]) + [
         "--allow-other",
         f"--uid={uid}",
         f"--gid={gid}",
     ]
-    cmd = [
-        "rclone",
-        "mount",
-        "--config",
-        config_path,
-        f"{template}:{remotepath}",
-        fullpath,
-    ] + cmd_args
+    cmd = (
+        ["rclone", "mount"]
+        + rclone_config["args"]
+        + [f"{rclone_config['name']}:{remotepath}", fullpath]
+        + cmd_args
+    )
     cmd += type_specific_args(item)
     if item.options.readonly:
         cmd += ["--read-only"]
     return cmd
 
 
-async def create_config(item: DataMountModel):
+async def render_config(item: DataMountModel):
     skip_keys = {
         "readonly",
         "displayName",
         "remotepath",
     }  # They're used in the command as arguments, not in the config file itself
-    config = {
-        k: v for k, v in deepcopy(item.options.config).items() if k not in skip_keys
-    }
+    config = {}
+    labels = metrics.mount_labels(item)
+    with tracing.span("render_config"), metrics.timer(
+        metrics.mount_phase, "config", *labels
+    ):
+        for key, value in deepcopy(item.options.config).items():
+            if key in skip_keys:
+                continue
+            if key.startswith("obscure_"):
+                value = await obscure(value)
+                key = key[len("obscure_") :]
+            config[key] = value
+    return config
 
-    template = item.options.template
 
-    s = f"[{template}]"
+def config_to_string(name: str, config: dict):
+    s = f"[{name}]"
     for key, value in config.items():
-        if key.startswith("obscure_"):
-            value = await obscure(value)
-            key = key[len("obscure_") :]
         s += f"\n{key} = {value}"
+    return s
+
+
+def env_remote_name(template: str):
+    # Remote names given via environment may only contain letters,
+    # digits and underscores
+    return re.sub(r"[^A-Za-z0-9_]", "_", template)
+
 
-    tmpfile = tempfile.NamedTemporaryFile(delete=False, mode="w")
-    with tmpfile as f:
-        f.write(s)
+async def create_config(item: DataMountModel):
+    """Renders the config of the remote and how to hand it to rclone.
+
+    By default as RCLONE_CONFIG_<NAME>_<KEY> environment variables, so no
+    credentials touch the disk. Otherwise as a file in the managed config
+    store, which is removed again on unmount or a failed mount.
+    """
+    config = await render_config(item)
+    if rclone_config_mode == "env":
+        name = env_remote_name(item.options.template)
+        env = {
+            f"RCLONE_CONFIG_{name.upper()}_{key.upper()}": str(value)
+            for key, value in config.items()
+        }
+        args = []
+    else:
+        name = item.options.template
+        env = {}
+        config_path = config_store.write(item.path, config_to_string(name, config))
+        args = ["--config", config_path]
+    return {"name": name, "config": config, "env": env, "args": args}
+
+
+def preflight_key(item: DataMountModel):
+    """Digest of everything the config check depends on. Secrets end up in
+    the digest only, never in the cache itself."""
+    key = {
+        "template": item.options.template,
+        "external": item.options.external,
+        "config": item.options.config,
+        "args": type_specific_args(item),
+    }
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=str).encode()
+    ).hexdigest()
 
-    return tmpfile.name
 
+async def cached_check(item: DataMountModel, check, *args):
+    """Runs the config check check(*args) unless a result for the same config
+    is cached. Failures are cached for a short time only, so a broken
+    remote that's retried over and over doesn't spawn a check each time."""
+    labels = metrics.mount_labels(item)
+    if not item.options.cache_check:
+        with tracing.span("check_config", cached=False):
+            with metrics.timer(metrics.mount_phase, "check", *labels):
+                return await check(*args)
+    key = preflight_key(item)
+    missing = object()
+    result = preflight_cache.get(key, missing)
+    if result is not missing:
+        getLogger().info(f"Check rclone config ... cached")
+        tracing.add_event("check_config cached")
+        return result
+    # Concurrent mounts of the same config (e.g. a batch) share one check
+    task = preflight_checks.get(key, None)
+    if task is None:
+        task = asyncio.create_task(_check_and_cache(key, labels, check, *args))
+        preflight_checks[key] = task
+        task.add_done_callback(lambda _: preflight_checks.pop(key, None))
+    else:
+        getLogger().info(f"Check rclone config ... shared")
+        tracing.add_event("check_config shared")
+    return await asyncio.shield(task)
+
+
+async def _check_and_cache(key: str, labels: tuple, check, *args):
+    with tracing.span("check_config"):
+        with metrics.timer(metrics.mount_phase, "check", *labels):
+            result = await check(*args)
+    preflight_cache.set(
+        key, result, ttl=preflight_cache_negative_ttl if result else None
+    )
+    return result
 
-async def check_rclone_config(item: DataMountModel, config_path: str):
+
+async def check_rclone_config(item: DataMountModel, rclone_config: dict):
     """Runs 'rclone lsd' to check if the remote storage is accessible."""
     log = getLogger()
     log.info(f"Check rclone config ...")
-    template = item.options.template
     remotepath = item.options.config.get("remotepath", "None")
-    cmd = [
-        "rclone",
-        "lsd",
-        "--config",
-        config_path,
-        f"{template}:{remotepath}",
-    ] + type_specific_args(item)
+    cmd = (
+        ["rclone", "lsd"]
+        + rclone_config["args"]
+        + [f"{rclone_config['name']}:{remotepath}"]
+        + type_specific_args(item)
+    )
     log.debug(f"Run cmd: {' '.join(cmd)}")
     process = await asyncio.create_subprocess_exec(
-        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env={**os.environ, **rclone_config["env"]},
     )
+    tracing.add_event("subprocess", executable="rclone lsd", pid=process.pid)
     _, stderr = await process.communicate()
 
     if process.returncode != 0:
-        with open(config_path) as f:
-            config_string = f.read()
+        config_string = config_to_string(item.options.template, rclone_config["config"])
         log.info(f"Check rclone config ... failed")
         log.info(stderr.decode().strip())
         description = {
@@ -164,133 +355,754 @@ async def check_rclone_config(item: DataMountModel, config_path: str):
     log.info(f"Check rclone config ... successful")
 
 
-async def run_process(command: list, timeout: float = 1.0):
-    """Run rclone mount command asynchronously."""
-    process = await asyncio.create_subprocess_exec(
-        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
+async def rcd_check_config(item: DataMountModel, name: str, config: dict):
+    """Lists the remote through the rclone rcd to check if it's accessible."""
+    log = getLogger()
+    log.info(f"Check rclone config ...")
+    remotepath = item.options.config.get("remotepath", "None")
     try:
-        # Wait up to 5 second to see if process exits immediately
-        await asyncio.wait_for(process.wait(), timeout=timeout)
-        # Process exited quickly — check the return code
-        _, stderr = await process.communicate()
-        raise RuntimeError(
-            f"Process exited early with code {process.returncode}:\n{stderr.decode().strip()}"
+        await rcd.list_dirs(f"{name}:", remotepath)
+    except rcd.RCError as e:
+        log.info(f"Check rclone config ... failed")
+        log.info(str(e))
+        description = {
+            "error": str(e),
+            "message": "Config not working.",
+        }
+        if not item.options.external:
+            description["config"] = config_to_string(item.options.template, config)
+        return description
+    log.info(f"Check rclone config ... successful")
+
+
+async def rcd_mount(item: DataMountModel):
+    """Mounts an rclone remote through the rclone rcd.
+
+    Returns a config error description if the remote is not accessible.
+    """
+    log = getLogger()
+    fullpath = await prepare_mountpoint(item.path)
+    name = rcd.remote_name(item.path)
+    config = await render_config(item)
+    type_ = config.pop("type")
+    config.update(backend_parameters(item))
+    await rcd.create_remote(name, type_, config)
+    try:
+        config_error = await cached_check(
+            item, rcd_check_config, item, name, {"type": type_, **config}
+        )
+        if config_error:
+            await rcd.delete_remote(name)
+            return config_error
+        remotepath = item.options.config.get("remotepath", "None")
+        options = profiles.to_rc_options(profiles.resolve(item)["flags"])
+        vfs_opt = {
+            **options["vfsOpt"],
+            "CacheMaxSize": vfs_cache.default_max_size,
+            "UID": int(uid),
+            "GID": int(gid),
+            "ReadOnly": item.options.readonly,
+        }
+        if vfs_cache.enabled():
+            size = await vfs_cache.allocate(
+                item.path, item.options.cache_weight, rcd.cache_dirs(name)
+            )
+            vfs_opt["CacheMaxSize"] = vfs_cache.format_size(size)
+            if vfs_cache.min_free_space:
+                vfs_opt["CacheMinFreeSpace"] = vfs_cache.min_free_space
+        log.debug(f"Run rc: mount/mount {name}:{remotepath} {fullpath}")
+        await rcd.mount(
+            f"{name}:{remotepath}",
+            fullpath,
+            {**options["mountOpt"], "AllowOther": True},
+            vfs_opt,
+            options["_config"],
         )
-    except asyncio.TimeoutError:
-        # Process is still running — treat as successful launch
-        return process
+    except:
+        await rcd.delete_remote(name)
+        raise
+    if mountinfo.available():
+        try:
+            await mountinfo.wait_for_mount(fullpath, timeout=mount_ready_timeout)
+        except asyncio.TimeoutError:
+            await rcd.unmount(fullpath)
+            await rcd.delete_remote(name)
+            raise RuntimeError(f"Mount not ready after {mount_ready_timeout} seconds")
 
 
-def is_directory_usable(path: str) -> bool:
+async def run_process(
+    command: list,
+    path: str,
+    timeout: float = None,
+    env: dict = None,
+    oneshot: bool = False,
+):
+    """Run a mount command and wait until the path is mounted.
+
+    Returns the process, or None for one-shot mount helpers which exit
+    after the mount was established, and the OutputPump draining its
+    stdout / stderr. The mount shows up right before a one-shot helper
+    exits, so its exit is awaited as well.
+    """
+    if timeout is None:
+        timeout = mount_ready_timeout
+    fullpath = os.path.join(base_mount_dir, path)
+    if detached():
+        # The process must survive this one to be reattached after a
+        # restart or by another worker, so no pipes and no shared session
+        log_fd = journal.open_log_file(path)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=log_fd,
+                stderr=log_fd,
+                env={**os.environ, **env} if env else None,
+                start_new_session=True,
+            )
+        finally:
+            os.close(log_fd)
+        output = LogFileOutput(path, journal.log_file(path), process)
+    else:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, **env} if env else None,
+        )
+        output = OutputPump(path, process)
+    # Only the executable, arguments may contain credentials
+    tracing.add_event("subprocess", executable=command[0], pid=process.pid)
     try:
-        return os.path.isdir(path) and os.listdir(path) is not None
+        if not mountinfo.available():
+            # No mount table to watch, treat a process that's still running
+            # after one second as successful launch
+            try:
+                await asyncio.wait_for(process.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                return process, output
+            mounted = False
+        else:
+            try:
+                mounted = await mountinfo.wait_for_mount(fullpath, process, timeout)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"Mount not ready after {timeout} seconds")
+            if oneshot and mounted:
+                await asyncio.wait_for(process.wait(), timeout)
+    except BaseException:
+        # Timed out or cancelled, nobody else knows about the process
+        await terminate(process)
+        raise
+    if process.returncode is None:
+        return process, output
+    await output.wait_closed()
+    if mounted and process.returncode == 0:
+        return None, output
+    raise RuntimeError(
+        f"Process exited early with code {process.returncode}:\n{output.text('stderr').strip()}"
+    )
+
+
+async def is_directory_usable(path: str, timeout: float = 5.0) -> bool:
+    try:
+        return await fsops.is_usable(path, timeout)
     except Exception as e:
-        print(f"[Error] Directory '{path}' is not usable: {e}")
+        getLogger().warning(f"Directory '{path}' is not usable: {repr(e)}")
         return False
 
 
 async def mount(item: DataMountModel):
+    labels = metrics.mount_labels(item)
+    span = tracing.span("mount", path=item.path, template=item.options.template)
+    with span:
+        jobs.phase("waiting_for_slot")
+        async with mount_semaphore:
+            try:
+                with metrics.timer(metrics.mount_phase, "total", *labels):
+                    success, error = await _mount(item)
+            except Exception as e:
+                cause = metrics.failure_cause(e)
+                metrics.mount_failures.labels(labels[0], cause).inc()
+                raise
+            if not success:
+                metrics.mount_failures.labels(labels[0], "config").inc()
+            return success, error
+
+
+async def _mount(item: DataMountModel):
     global mounts
     log = getLogger()
     log.info(f"Mount {item.path} ...")
     validate(item)
-    timeout = 1.0
+    labels = metrics.mount_labels(item)
+    fullpath = os.path.join(base_mount_dir, item.path)
+    backend = "process"
+    config_error = None
+    env = None
     if item.options.template == "uftp":
-        cmd = uftp.cmd(item)
+        jobs.phase("uftp_auth")
+        with metrics.timer(metrics.mount_phase, "uftp_auth", *labels):
+            cmd = await uftp.cmd(item)
     elif item.options.template == "nfs":
-        cmd = nfs.cmd(item)
-        timeout = 5.0
+        cmd = await nfs.cmd(item)
+    elif rcd.enabled:
+        backend = "rcd"
+        jobs.phase("rcd_mount")
+        with tracing.span("rcd_mount"):
+            with metrics.timer(metrics.mount_phase, "rcd_mount", *labels):
+                config_error = await rcd_mount(item)
     else:
-        config_path = await create_config(item)
-        cmd = get_cmd(item, config_path)
-        config_error = await check_rclone_config(item, config_path)
-        if config_error:
-            log.info(
-                f"Mount {item.path} ... failed. Error: {config_error.get('error', 'unknown')}"
-            )
-            return False, config_error
-    log.debug(f"Run cmd: {' '.join(cmd)}")
-    process = await run_process(cmd, timeout)
+        jobs.phase("config")
+        with tracing.span("create_config", mode=rclone_config_mode):
+            rclone_config = await create_config(item)
+        env = rclone_config["env"]
+        cmd = await get_cmd(item, rclone_config)
+        jobs.phase("check_config")
+        config_error = await cached_check(
+            item, check_rclone_config, item, rclone_config
+        )
+    if config_error:
+        log.info(
+            f"Mount {item.path} ... failed. Error: {config_error.get('error', 'unknown')}"
+        )
+        await cleanup(item.path)
+        return False, config_error
+    if backend == "rcd":
+        process, output = None, None
+    else:
+        log.debug(f"Run cmd: {' '.join(cmd)}")
+        jobs.phase("starting_process")
+        try:
+            with tracing.span("run_process"), metrics.timer(
+                metrics.mount_phase, "process", *labels
+            ):
+                process, output = await run_process(
+                    cmd, item.path, env=env, oneshot=item.options.template == "nfs"
+                )
+        except BaseException:
+            await abandon(item, None)
+            raise
+
+    try:
+        async with lock:
+            mounts[item.path] = {
+                "process": process,
+                "output": output,
+                "backend": backend,
+                "model": item.model_dump(),
+                "task": None,
+                "profile": (
+                    None
+                    if item.options.template in ["nfs", "uftp"]
+                    else profiles.resolve(item)
+                ),
+            }
+        record = journal_record(item.path)
+        await registry.add(item.path, record)
+        journal.record_mount(item.path, record)
+        # Started once registered, it only cleans up registered mounts
+        mounts[item.path]["task"] = track(process, item.path)
+    except BaseException:
+        await abandon(item, process)
+        raise
+
+    jobs.phase("checking_directory")
+    with tracing.span("is_directory_usable"), metrics.timer(
+        metrics.mount_phase, "usable", *labels
+    ):
+        usable = await is_directory_usable(fullpath)
+    if not usable:
+        raise Exception(
+            "Mount failed. Directory not usable. Check if remote path exists."
+        )
+
+    log.info(f"Mount {item.path} ... successful")
+    return True, None
+
+
+async def abandon(item: DataMountModel, process):
+    """Undoes a mount that failed or was cancelled before it was tracked.
+    Nothing else knows about it yet, so its process is stopped and a
+    mountpoint it left behind is lazily unmounted here."""
+    if process is not None:
+        await terminate(process)
+    fullpath = os.path.join(base_mount_dir, item.path)
+    if mountinfo.available() and mountinfo.is_mounted(fullpath):
+        returncode, stderr = await run_umount(fullpath, lazy=True)
+        if returncode != 0:
+            getLogger().warning(f"Could not unmount {fullpath}: {stderr}")
+    async with lock:
+        entry = mounts.pop(item.path, None)
+    if entry is not None:
+        await registry.remove(item.path)
+        journal.record_unmount(item.path)
+    if item.options.template == "uftp":
+        uftp.forget(item)
+    await cleanup(item.path)
+
+
+def track(process, path: str):
+    """Starts the task removing a mount from the registry when its
+    process is no longer running, or the mount is gone for one-shot
+    mount helpers."""
+    fullpath = os.path.join(base_mount_dir, path)
 
-    # When the process is no longer running
-    # we remove it from the mounts dict
     async def done_callback(process, path):
-        await process.wait()
+        if process:
+            await process.wait()
+        else:
+            await mountinfo.wait_for_unmount(fullpath)
+        # Unless another worker took the mount over and cleans up itself
+        if await registry.owns(path, process.pid if process else None):
+            await cleanup(path)
+            await registry.remove(path)
+        else:
+            # Its files belong to the new owner now
+            vfs_cache.allocations.pop(path, None)
         async with lock:
-            if path in mounts:
+            if mounts.get(path, {}).get("task", None) is asyncio.current_task():
                 del mounts[path]
+        journal.record_unmount(path)
 
-    task = asyncio.create_task(done_callback(process, item.path))
+    task = asyncio.create_task(done_callback(process, path))
     background_tasks.add(task)
     task.add_done_callback(background_tasks.discard)
+    return task
+
 
-    mounts[item.path] = {
-        "process": process,
-        "model": item.model_dump(),
+def journal_record(path: str):
+    entry = mounts[path]
+    process = entry["process"]
+    return {
+        "pid": process.pid if process else None,
+        "start_time": journal.process_start_time(process.pid) if process else None,
+        "backend": entry["backend"],
+        "model": entry["model"],
+        "profile": entry["profile"],
+        "allocation": vfs_cache.allocations.get(path, None),
+        "log_file": isinstance(entry["output"], LogFileOutput),
     }
 
-    fullpath = os.path.join(base_mount_dir, item.path)
-    if not is_directory_usable(fullpath):
-        raise Exception(
-            "Mount failed. Directory not usable. Check if remote path exists."
+
+async def reattach(path: str, record: dict, mountpoints: set = None) -> bool:
+    """Registers a mount of a previous instance or a gone worker again
+    without remounting, if it's still in the mount table and its process
+    (if it ever had one, unlike NFS) is still running. Otherwise cleans
+    it up. rcd mounts can't be reattached, the daemon doesn't know them.
+    """
+    log = getLogger()
+    fullpath = os.path.join(base_mount_dir, path)
+    process = journal.adopt(record)
+    if mountpoints is None:
+        mounted = process is not None
+    else:
+        mounted = os.path.normpath(fullpath) in mountpoints
+    if (
+        record["backend"] != "rcd"
+        and mounted
+        and (process is not None or record["pid"] is None)
+    ):
+        output = None
+        if process is not None and record["log_file"]:
+            output = LogFileOutput(path, journal.log_file(path), process, from_end=True)
+        vfs_cache.restore(path, record["allocation"])
+        async with lock:
+            mounts[path] = {
+                "process": process,
+                "output": output,
+                "backend": record["backend"],
+                "model": record["model"],
+                "task": None,
+                "profile": record["profile"],
+            }
+        await registry.add(path, journal_record(path))
+        mounts[path]["task"] = track(process, path)
+        log.info(f"Reattach {path} ... successful")
+        return True
+    log.info(f"Reattach {path} ... stale, clean up")
+    if process is not None:
+        await stop_process(process, kill=True)
+    if mounted:
+        await run_umount(fullpath, lazy=True)
+        fsops.release(fullpath)
+    vfs_cache.restore(path, record["allocation"])
+    await cleanup(path)
+    await registry.remove(path, record.get("owner", None))
+    try:
+        await fsops.rmdir(fullpath)
+    except OSError:
+        pass
+    return False
+
+
+def current_mountpoints():
+    return mountinfo.get_mountpoints() if mountinfo.available() else None
+
+
+async def reattach_mounts():
+    """Takes over the mounts of a previous instance from the journal, or
+    from the shared registry, where all owners are gone after a restart."""
+    if shared_registry:
+        await adopt_orphans()
+        return
+    if not journal.enabled():
+        return
+    records = journal.load()
+    mountpoints = current_mountpoints()
+    for path, record in records.items():
+        await reattach(path, record, mountpoints)
+    journal.compact({path: records[path] for path in mounts if path in records})
+
+
+async def adopt_orphans():
+    """Takes over the mounts of workers that are gone, e.g. restarted
+    after max_requests. Every orphan is claimed by exactly one worker."""
+    mountpoints = None
+    for path, record in (await registry.orphans()).items():
+        async with get_path_lock(path):
+            if not await registry.claim(path, record["owner"]):
+                continue
+            if mountpoints is None:
+                mountpoints = current_mountpoints()
+            await reattach(path, dict(record, owner=os.getpid()), mountpoints)
+
+
+async def release_registry():
+    """Unmounts everything left in the shared registry. Called by the
+    gunicorn master on exit, after all workers kept their mounts for
+    the others. Nothing else runs in its event loop, so the calls block."""
+    log = getLogger()
+    for path, record in (await registry.all()).items():
+        fullpath = os.path.join(base_mount_dir, path)
+        process = journal.adopt(record)
+        if process is not None:
+            try:
+                process.terminate()
+            except ProcessLookupError:
+                pass
+        subprocess.run(["umount", "-l", fullpath], capture_output=True)
+        for directory in (record["allocation"] or {}).get("usage_dirs", []):
+            shutil.rmtree(directory, True)
+        config_store.remove(path)
+        journal.remove_log_file(path)
+        await registry.remove(path, record["owner"])
+        try:
+            os.rmdir(fullpath)
+        except OSError:
+            pass
+        log.info(f"Unmount {path} ... lazy")
+
+
+async def cleanup(path: str):
+    """Removes what a mount leaves behind besides its mountpoint."""
+    config_store.remove(path)
+    journal.remove_log_file(path)
+    await vfs_cache.release(path)
+
+
+async def run_umount(fullpath: str, lazy: bool = False):
+    """Runs umount, returns its exit code and stderr."""
+    cmd = ["umount", "-l", fullpath] if lazy else ["umount", fullpath]
+    with tracing.span("run_umount", lazy=lazy):
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
         )
+        tracing.add_event("subprocess", executable="umount", pid=process.pid)
+        _, stderr = await process.communicate()
+    return process.returncode, stderr.decode().strip()
 
-    log.info(f"Mount {item.path} ... successful")
-    return True, None
 
+async def terminate(process, grace: float = stop_grace_period):
+    """Terminates a process, kills it if it's still running after grace
+    seconds."""
+    try:
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+        except asyncio.TimeoutError:
+            process.kill()
+    except ProcessLookupError:
+        pass
+    await process.wait()
 
-async def unmount(path: str, force: bool = False):
-    fullpath = os.path.join(base_mount_dir, path)
-    process = await asyncio.create_subprocess_exec(
-        *["umount", fullpath],
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await process.communicate()
-    stdout = stdout.decode().strip()
-    stderr = stderr.decode().strip()
-    if process.returncode != 0 and not force:
-        raise Exception(stderr)
 
+async def stop_process(process, kill: bool = False):
     try:
-        mount_process = mounts.get(path, {}).get("process", None)
-        if mount_process:
-            mount_process.terminate()
-            await mount_process.wait()
+        if kill:
+            process.kill()
+        else:
+            process.terminate()
+        await process.wait()
     except ProcessLookupError:
         pass
 
-    if process.returncode != 0:
+
+async def unmount(path: str, force: bool = False):
+    entry = mounts.get(path, None) or await registry.get(path) or {}
+    backend = entry.get("backend", "process")
+    try:
+        with tracing.span("unmount", path=path, backend=backend, force=force):
+            with metrics.timer(metrics.unmount_phase, "total", backend):
+                await _unmount(path, force, backend)
+    except:
+        metrics.unmount_failures.labels(backend).inc()
+        raise
+
+
+async def _unmount(path: str, force: bool, backend: str):
+    fullpath = os.path.join(base_mount_dir, path)
+    if backend == "rcd":
+        returncode = 0
+        try:
+            with tracing.span("rc_unmount"), metrics.timer(
+                metrics.unmount_phase, "rc_unmount", backend
+            ):
+                await rcd.unmount(fullpath)
+        except rcd.RCError as e:
+            if not force:
+                raise Exception(str(e))
+            returncode = 1
+        try:
+            await rcd.delete_remote(rcd.remote_name(path))
+        except rcd.RCError:
+            pass
+    else:
+        with metrics.timer(metrics.unmount_phase, "umount", backend):
+            returncode, stderr = await run_umount(fullpath)
+        if returncode != 0 and not force:
+            raise Exception(stderr)
+
+        if path in mounts:
+            mount_process = mounts[path]["process"]
+        else:
+            mount_process = await take_over(path)
+        if mount_process:
+            with tracing.span("stop_process"), metrics.timer(
+                metrics.unmount_phase, "stop_process", backend
+            ):
+                await stop_process(mount_process)
+
+    if returncode != 0:
         # first umount failed, call umount with -l
         # That's only called with force: true
-        await asyncio.create_subprocess_exec(
-            *["umount", "-l", fullpath],
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+        with metrics.timer(metrics.unmount_phase, "lazy_umount", backend):
+            await run_umount(fullpath, lazy=True)
+    # Detached, calls on the path don't reach a hung mount anymore
+    fsops.release(fullpath)
+
+    with tracing.span("cleanup"), metrics.timer(
+        metrics.unmount_phase, "cleanup", backend
+    ):
+        await cleanup(path)
+    await registry.remove(path)
+    with tracing.span("rmdir"):
+        await fsops.rmdir(fullpath)
+
+
+async def take_over(path: str):
+    """Claims the mount of another worker to unmount it. Returns its
+    process, if it's still running."""
+    record = await registry.get(path)
+    if record is None or not await registry.claim(path, record["owner"]):
+        return None
+    vfs_cache.restore(path, record["allocation"])
+    return journal.adopt(record)
+
+
+async def shutdown_unmount(path: str, deadline: float):
+    """Unmounts one mount at shutdown, escalating from a graceful unmount
+    to a lazy unmount to SIGKILL as the deadline comes closer.
+
+    Returns the outcome: "unmounted", "lazy", "killed" or "failed".
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    fullpath = os.path.join(base_mount_dir, path)
+    process = mounts.get(path, {}).get("process", None)
+
+    # Half of the time for a graceful unmount
+    try:
+        await asyncio.wait_for(unmount(path, force=False), (deadline - start) * 0.5)
+        return "unmounted"
+    except Exception:
+        pass
+
+    # Most of the rest to detach it lazily and let the process exit
+    outcome = "lazy"
+    try:
+        await asyncio.wait_for(
+            run_umount(fullpath, lazy=True), (deadline - loop.time()) * 0.4
         )
-        await process.communicate()
+        if process:
+            await asyncio.wait_for(
+                stop_process(process), (deadline - loop.time()) * 0.6
+            )
+    except Exception:
+        outcome = "failed"
 
-    os.rmdir(fullpath)
+    # Out of time, don't wait for the process any longer
+    if process and process.returncode is None:
+        try:
+            process.kill()
+            outcome = "killed"
+        except ProcessLookupError:
+            pass
+    await cleanup(path)
+    fsops.release(fullpath)
+    try:
+        await fsops.rmdir(fullpath)
+    except OSError:
+        pass
+    return outcome
 
 
-async def init_mounts():
-    init_mounts_path = os.environ.get("INIT_MOUNTS", "/mnt/config/mounts.json")
+async def unmount_all(timeout: float = None):
+    """Unmounts all mounts concurrently within timeout seconds."""
     log = getLogger()
-    if os.path.exists(init_mounts_path):
-        log.info("Init mounts ...")
-        mounts = {}
-        with open(init_mounts_path) as f:
-            mounts = json.load(f)
-        for mount_config in mounts:
+    if timeout is None:
+        timeout = shutdown_timeout
+    paths = list(mounts.keys())
+    if not paths:
+        return {}
+    log.info(f"Unmount all ({len(paths)}) ...")
+    deadline = asyncio.get_running_loop().time() + timeout
+    results = await asyncio.gather(
+        *[shutdown_unmount(path, deadline) for path in paths],
+        return_exceptions=True,
+    )
+    outcomes = {}
+    for path, result in zip(paths, results):
+        outcomes[path] = "failed" if isinstance(result, BaseException) else result
+        log.info(f"Unmount {path} ... {outcomes[path]}")
+    summary = {}
+    for outcome in outcomes.values():
+        summary[outcome] = summary.get(outcome, 0) + 1
+    log.info(f"Unmount all ({len(paths)}) ... done", extra={"outcomes": summary})
+    return outcomes
+
+
+def get_init_mounts_state():
+    global init_mounts_state
+    return init_mounts_state
+
+
+async def init_mount(mount_config: dict, semaphore: asyncio.Semaphore):
+    global init_mounts_state
+    log = getLogger()
+    path = mount_config.get("path", "unknown path")
+    init_mounts_state[path] = "pending"
+    async with semaphore:
+        try:
             item = DataMountModel(**mount_config)
             item.options.external = True
-            try:
+            async with get_path_lock(item.path):
+                if await registry.get(item.path) is not None:
+                    # Reattached or mounted by another worker
+                    init_mounts_state[path] = "ready"
+                    return
                 log.info(f"Mount {item.path} ...")
-                success, error_process = await mount(item)
-                if not success:
-                    raise Exception(f"Mount failed: {error_process}")
-            except:
-                log.exception(
-                    f"Mount {mount_config.get('path', 'unknown path')} failed"
-                )
+                try:
+                    success, error_process = await asyncio.wait_for(
+                        mount(item), init_mounts_timeout
+                    )
+                except:
+                    try:
+                        await unmount(item.path, force=True)
+                    except:
+                        pass
+                    raise
+            if not success:
+                raise Exception(f"Mount failed: {error_process}")
+            init_mounts_state[path] = "ready"
+        except:
+            init_mounts_state[path] = "failed"
+            log.exception(f"Mount {path} failed")
+
+
+def read_init_mounts():
+    mounts = []
+    if os.path.exists(init_mounts_path):
+        with open(init_mounts_path) as f:
+            mounts = json.load(f)
+    return mounts
+
+
+def load_init_mounts():
+    """Reads the init mounts and marks them as pending."""
+    mounts = read_init_mounts()
+    for mount_config in mounts:
+        path = mount_config.get("path", "unknown path")
+        init_mounts_state[path] = "pending"
+        init_mounts_config[path] = mount_config
+    return mounts
+
+
+async def init_mounts(mounts: list = None):
+    log = getLogger()
+    if mounts is None:
+        mounts = load_init_mounts()
+    if mounts:
+        log.info("Init mounts ...")
+        semaphore = asyncio.Semaphore(init_mounts_parallelism)
+        await asyncio.gather(
+            *[init_mount(mount_config, semaphore) for mount_config in mounts]
+        )
+        log.info("Init mounts ... done")
+
+
+async def init_unmount(path: str, semaphore: asyncio.Semaphore):
+    """Unmounts a mount dropped from the init mounts file. Mounts created
+    via the API on the same path are left alone."""
+    log = getLogger()
+    async with semaphore:
+        try:
+            async with get_path_lock(path):
+                record = await registry.get(path)
+                if record is None:
+                    return
+                if not record["model"].get("options", {}).get("external", False):
+                    return
+                log.info(f"Unmount {path} ...")
+                await unmount(path, force=True)
+                log.info(f"Unmount {path} ... successful")
+        except:
+            log.exception(f"Unmount {path} ... failed")
+
+
+async def reload_init_mounts():
+    """Applies changes of the init mounts file. Entries that were removed
+    or changed are unmounted, then changed, added and not yet mounted
+    ones are mounted. Unchanged mounts are not touched."""
+    log = getLogger()
+    mounts = {
+        mount_config.get("path", "unknown path"): mount_config
+        for mount_config in read_init_mounts()
+    }
+    stale = [
+        path
+        for path, mount_config in init_mounts_config.items()
+        if mounts.get(path, None) != mount_config
+    ]
+    missing = [
+        path
+        for path, mount_config in mounts.items()
+        if init_mounts_config.get(path, None) != mount_config
+        or await registry.get(path) is None
+    ]
+    if not stale and not missing:
+        return
+    log.info(
+        "Reload init mounts ...",
+        extra={"unmount": stale, "mount": missing},
+    )
+    semaphore = asyncio.Semaphore(init_mounts_parallelism)
+    await asyncio.gather(*[init_unmount(path, semaphore) for path in stale])
+    for path in stale:
+        init_mounts_config.pop(path, None)
+        init_mounts_state.pop(path, None)
+    for path in missing:
+        init_mounts_config[path] = mounts[path]
+        init_mounts_state[path] = "pending"
+    await asyncio.gather(*[init_mount(mounts[path], semaphore) for path in missing])
+    log.info("Reload init mounts ... done")
@@ -1,5 +1,85 @@
 import os
 
 base_mount_dir = os.environ.get("BASE_DIR", "/mnt/data_mounts")
+logging_config_path = os.environ.get("LOGGING_CONFIG_FILE", "/mnt/config/logging.json")
 uid = os.environ.get("NB_UID", 1000)
 gid = os.environ.get("NB_GID", 100)
+max_concurrent_mounts = int(os.environ.get("MAX_CONCURRENT_MOUNTS", 10))
+mount_ready_timeout = float(os.environ.get("MOUNT_READY_TIMEOUT", 30))
+init_mounts_path = os.environ.get("INIT_MOUNTS", "/mnt/config/mounts.json")
+init_mounts_parallelism = int(os.environ.get("INIT_MOUNTS_PARALLELISM", 4))
+init_mounts_timeout = float(os.environ.get("INIT_MOUNTS_TIMEOUT", 120))
+init_mounts_background = os.environ.get("INIT_MOUNTS_BACKGROUND", "false") in [
+    "true",
+    "1",
+]
+shutdown_timeout = float(os.environ.get("SHUTDOWN_TIMEOUT", 25))
+# Seconds a terminated mount process gets before it is killed
+stop_grace_period = float(os.environ.get("STOP_GRACE_PERIOD", 5))
+preflight_cache_size = int(os.environ.get("PREFLIGHT_CACHE_SIZE", 256))
+preflight_cache_ttl = float(os.environ.get("PREFLIGHT_CACHE_TTL", 600))
+preflight_cache_negative_ttl = float(os.environ.get("PREFLIGHT_CACHE_NEGATIVE_TTL", 10))
+native_obscure = os.environ.get("RCLONE_OBSCURE", "native") == "native"
+# "env" passes rclone configs as environment variables, "file" writes
+# them to the config store directory
+rclone_config_mode = os.environ.get("RCLONE_CONFIG_MODE", "env")
+config_store_dir = os.environ.get(
+    "RCLONE_CONFIG_DIR",
+    "/dev/shm/datamount" if os.path.isdir("/dev/shm") else "/tmp/datamount",
+)
+# Overrides and additions to the built-in mount profiles, next to the
+# init mounts file by default
+profiles_path = os.environ.get(
+    "PROFILES_FILE",
+    os.path.join(
+        os.path.dirname(init_mounts_path),
+        "profiles.json",
+    ),
+)
+# Seconds between health probes of all mounts, 0 disables the monitor
+health_interval = float(os.environ.get("HEALTH_INTERVAL", 30))
+health_probe_timeout = float(os.environ.get("HEALTH_PROBE_TIMEOUT", 5))
+health_degraded_latency = float(os.environ.get("HEALTH_DEGRADED_LATENCY", 1))
+health_dead_after = int(os.environ.get("HEALTH_DEAD_AFTER", 3))
+health_remount = os.environ.get("HEALTH_REMOUNT", "false") in ["true", "1"]
+health_remount_backoff = float(os.environ.get("HEALTH_REMOUNT_BACKOFF", 10))
+health_remount_max_backoff = float(os.environ.get("HEALTH_REMOUNT_MAX_BACKOFF", 600))
+health_remount_max_attempts = int(os.environ.get("HEALTH_REMOUNT_MAX_ATTEMPTS", 5))
+# Asynchronous mounts (POST /?async=true)
+job_workers = int(os.environ.get("JOB_WORKERS", max_concurrent_mounts))
+job_queue_size = int(os.environ.get("JOB_QUEUE_SIZE", 100))
+job_ttl = float(os.environ.get("JOB_TTL", 3600))
+batch_parallelism = int(os.environ.get("BATCH_PARALLELISM", 8))
+# Journal of the active mounts, a restarted process reattaches them
+# instead of mounting again. Mount processes then log into files and
+# are left running at shutdown.
+mount_journal = os.environ.get("MOUNT_JOURNAL", "false") in ["true", "1"]
+journal_path = os.environ.get(
+    "MOUNT_JOURNAL_FILE", os.path.join(config_store_dir, "journal.jsonl")
+)
+# Mount registry and path locks shared by all workers of the service
+# (GUNICORN_WORKERS > 1), kept in SQLite next to the rclone configs
+shared_registry = os.environ.get("SHARED_REGISTRY", "false") in ["true", "1"]
+gunicorn_workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+registry_path = os.environ.get(
+    "SHARED_REGISTRY_FILE", os.path.join(config_store_dir, "registry.sqlite3")
+)
+# Filesystem calls on mountpoints run in a thread pool, a mountpoint not
+# responding within the timeout is quarantined (see fsops.py)
+fs_ops_threads = int(os.environ.get("FS_OPS_THREADS", 16))
+fs_ops_timeout = float(os.environ.get("FS_OPS_TIMEOUT", 5))
+# Log handlers run on a thread behind a bounded queue. Records arriving
+# at a full queue are dropped, or with "block" waited for up to the timeout
+log_queue_size = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+log_queue_full_policy = os.environ.get("LOG_QUEUE_FULL_POLICY", "drop")
+log_queue_block_timeout = float(os.environ.get("LOG_QUEUE_BLOCK_TIMEOUT", 0.1))
+# Reload logging.json and mounts.json when they change (see config_watch.py)
+config_watch = os.environ.get("CONFIG_WATCH", "false") in ["true", "1"]
+# NFS mounts, NFS_BLOCKED_MOUNTS and NFS_ALLOWED_MOUNTS are read by
+# nfs_policy.load()
+nfs_enabled = os.environ.get("NFS_ENABLED", "false") not in ["false", "0"]
+# Mount by the checked address instead of the server name. Kerberos
+# (sec=krb5) needs the name, so it's off by default.
+nfs_pin_address = os.environ.get("NFS_PIN_ADDRESS", "false") in ["true", "1"]
+nfs_dns_ttl = float(os.environ.get("NFS_DNS_TTL", 60))
+nfs_dns_cache_size = int(os.environ.get("NFS_DNS_CACHE_SIZE", 1024))
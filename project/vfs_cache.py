@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import os
+import shutil
+
+import registry
+from log import getLogger
+from values import shared_registry
+
+# Without a total size every mount gets the fixed default size and rclone's
+# default cache directory, as before
+total_size_str = os.environ.get("VFS_CACHE_TOTAL_SIZE", "")
+cache_dir = os.environ.get("VFS_CACHE_DIR", "/tmp/rclone-vfs")
+min_size_str = os.environ.get("VFS_CACHE_MIN_SIZE", "1G")
+min_free_space = os.environ.get("VFS_CACHE_MIN_FREE_SPACE", "")
+# Shares are computed for at least this many mounts (of weight 1), so the
+# first mounts don't claim the whole budget
+expected_mounts = float(os.environ.get("VFS_CACHE_EXPECTED_MOUNTS", 10))
+default_max_size = "10G"
+
+suffixes = {
+    "B": 1,
+    "K": 1 << 10,
+    "M": 1 << 20,
+    "G": 1 << 30,
+    "T": 1 << 40,
+    "P": 1 << 50,
+}
+
+# path -> {"weight": float, "size": int, "usage_dirs": list}
+allocations = {}
+
+
+def parse_size(value: str) -> int:
+    """Parses rclone style sizes (10G, 512M, ...) into bytes. Like rclone,
+    values without suffix are KiB."""
+    value = value.strip().upper().removesuffix("IB").removesuffix("I")
+    if value and value[-1] in suffixes:
+        return int(float(value[:-1]) * suffixes[value[-1]])
+    return int(float(value) * suffixes["K"])
+
+
+def format_size(size: int) -> str:
+    return f"{size // suffixes['M']}M"
+
+
+total_size = parse_size(total_size_str) if total_size_str else None
+min_size = parse_size(min_size_str)
+
+
+def enabled() -> bool:
+    return total_size is not None
+
+
+def mount_cache_dir(path: str) -> str:
+    return os.path.join(cache_dir, hashlib.sha256(path.encode()).hexdigest()[:16])
+
+
+def targets() -> dict:
+    """Fair share of every active mount, proportional to its weight."""
+    total_weight = max(sum(a["weight"] for a in allocations.values()), expected_mounts)
+    return {
+        path: int(total_size * a["weight"] / total_weight)
+        for path, a in allocations.items()
+    }
+
+
+async def all_allocations() -> dict:
+    """Allocations of this worker and, with a shared registry, the ones
+    of the mounts of other workers."""
+    if not shared_registry:
+        return allocations
+    current = {
+        path: record["allocation"]
+        for path, record in (await registry.all()).items()
+        if record.get("allocation", None)
+    }
+    current.update(allocations)
+    return current
+
+
+async def allocate(path: str, weight: float = 1.0, usage_dirs: list = None) -> int:
+    """Assigns a share of the total cache size to a new mount.
+
+    rclone can't resize the cache of a running mount, so running mounts
+    keep their size until they're remounted. A new mount gets its fair
+    share, but never more than what is not yet assigned to others. Their
+    sizes add up to the total and the disk can't overflow. A share below
+    the minimum size is raised to it if that still fits, the mount is
+    refused otherwise.
+    """
+    current = await all_allocations()
+    others = sum(a["size"] for p, a in current.items() if p != path)
+    total_weight = max(
+        weight + sum(a["weight"] for p, a in current.items() if p != path),
+        expected_mounts,
+    )
+    fair = int(total_size * weight / total_weight)
+    remaining = total_size - others
+    size = max(min(fair, remaining), min_size)
+    if size > remaining:
+        getLogger().warning(
+            f"VFS cache budget exhausted, refusing {path}",
+            extra={"assigned": others, "total": total_size},
+        )
+        raise Exception(
+            f"VFS cache budget exhausted, {format_size(remaining)} of "
+            f"{format_size(total_size)} left, {format_size(min_size)} required"
+        )
+    allocations[path] = {
+        "weight": weight,
+        "size": size,
+        "usage_dirs": usage_dirs or [mount_cache_dir(path)],
+    }
+    return size
+
+
+def restore(path: str, allocation: dict):
+    """Takes over the share of a reattached mount, see journal.py."""
+    if enabled() and allocation:
+        allocations[path] = allocation
+
+
+async def args(path: str, weight: float = 1.0) -> list:
+    """rclone mount arguments for the cache of a mount."""
+    if not enabled():
+        return [f"--vfs-cache-max-size={default_max_size}"]
+    size = await allocate(path, weight)
+    cmd_args = [
+        f"--vfs-cache-max-size={format_size(size)}",
+        f"--cache-dir={mount_cache_dir(path)}",
+    ]
+    if min_free_space:
+        cmd_args.append(f"--vfs-cache-min-free-space={min_free_space}")
+    return cmd_args
+
+
+def _disk_usage(directories: list) -> int:
+    used = 0
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                try:
+                    used += os.lstat(os.path.join(root, name)).st_blocks * 512
+                except OSError:
+                    pass
+    return used
+
+
+async def release(path: str):
+    """Frees the share of a mount and removes its cached files."""
+    allocation = allocations.pop(path, None)
+    if allocation:
+        for directory in allocation["usage_dirs"]:
+            await asyncio.to_thread(shutil.rmtree, directory, True)
+
+
+async def usage() -> dict:
+    """Allocated size, fair share and used bytes per mount."""
+    if not enabled():
+        return {}
+    current = {path: dict(a) for path, a in allocations.items()}
+    shares = targets()
+    used = await asyncio.to_thread(
+        lambda: {p: _disk_usage(a["usage_dirs"]) for p, a in current.items()}
+    )
+    return {
+        path: {
+            "allocated": a["size"],
+            "target": shares.get(path, 0),
+            "used": used[path],
+        }
+        for path, a in current.items()
+    }
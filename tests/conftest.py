@@ -0,0 +1,80 @@
+"""Runs the API against the fake backends of fake_backend.py.
+
+The project modules read their configuration from the environment when
+they're imported, so it's set up here once for the whole session: a
+temporary directory for mountpoints, configs and the fake mount table,
+and the fake executables in front of PATH.
+"""
+import os
+import sys
+import tempfile
+from contextlib import asynccontextmanager
+
+import httpx
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.join(os.path.dirname(here), "project")
+tmp = tempfile.mkdtemp(prefix="datamount-test-")
+bin_dir = os.path.join(tmp, "bin")
+os.makedirs(bin_dir)
+os.makedirs(os.path.join(tmp, "mounts"))
+open(os.path.join(tmp, "mountinfo"), "w").close()
+os.environ.update(
+    {
+        "PATH": f"{bin_dir}:{os.environ.get('PATH', '')}",
+        "BASE_DIR": os.path.join(tmp, "mounts"),
+        "MOUNTINFO_FILE": os.path.join(tmp, "mountinfo"),
+        "RCLONE_CONFIG_DIR": os.path.join(tmp, "config"),
+        "RCLONE_RCD_CONFIG": os.path.join(tmp, "rcd.conf"),
+        "LOGGING_CONFIG_FILE": os.path.join(tmp, "logging.json"),
+        "INIT_MOUNTS": os.path.join(tmp, "mounts.json"),
+        "VFS_CACHE_DIR": os.path.join(tmp, "vfs"),
+        "NFS_ENABLED": "true",
+    }
+)
+sys.path.insert(0, here)
+sys.path.insert(0, project_dir)
+
+import fake_backend  # noqa: E402
+
+for command in fake_backend.commands:
+    os.symlink(os.path.join(here, "fake_backend.py"), os.path.join(bin_dir, command))
+
+
+@pytest.fixture
+def api():
+    """Runs the app with its lifespan and returns a client for it, as
+    async context manager."""
+    import main
+
+    @asynccontextmanager
+    async def client():
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=main.app),
+                base_url="http://datamount",
+            ) as client:
+                yield client
+
+    return client
+
+
+@pytest.fixture
+def mount_body():
+    def body(path: str, template: str = "s3") -> dict:
+        config = {
+            "s3": {
+                "type": "s3",
+                "provider": "Other",
+                "remotepath": "bucket",
+                "access_key_id": "test",
+            },
+            "nfs": {"server": "127.0.0.1", "remotepath": "/export"},
+        }[template]
+        return {
+            "path": path,
+            "options": {"displayName": path, "template": template, "config": config},
+        }
+
+    return body
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Stand-in for rclone, umount, mount.nfs4 and unicore-fusedriver.
+
+conftest.py and benchmarks/run.py link it under these names into a
+directory put in front of PATH. Nothing is mounted, mounts are lines
+appended to the file given as MOUNTINFO_FILE, which the API watches
+instead of /proc/self/mountinfo.
+
+Behaviour is configured via environment variables:
+  FAKE_STARTUP_DELAY  seconds until a mount shows up (0.05)
+  FAKE_CHECK_DELAY    seconds a config check (rclone lsd) takes (0.05)
+  FAKE_UNMOUNT_DELAY  seconds umount takes (0.01)
+  FAKE_FAILURE_RATE   probability that a mount process fails (0)
+  FAKE_OUTPUT_LINES   lines a mount process writes at startup (0)
+"""
+import base64
+import fcntl
+import json
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+mountinfo_path = os.environ["MOUNTINFO_FILE"]
+startup_delay = float(os.environ.get("FAKE_STARTUP_DELAY", 0.05))
+check_delay = float(os.environ.get("FAKE_CHECK_DELAY", 0.05))
+unmount_delay = float(os.environ.get("FAKE_UNMOUNT_DELAY", 0.01))
+failure_rate = float(os.environ.get("FAKE_FAILURE_RATE", 0))
+output_lines = int(os.environ.get("FAKE_OUTPUT_LINES", 0))
+
+
+def add_mount(fullpath: str, fstype: str):
+    line = f"1 1 0:1 / {fullpath} rw - {fstype} fake rw\n"
+    with open(mountinfo_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(line)
+
+
+def remove_mount(fullpath: str):
+    """Blanks the line of a mount in place. The API reads the file without
+    locking, rewriting it would let it see a partial mount table."""
+    with open(mountinfo_path, "r+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        offset = 0
+        mounted = False
+        for line in f.read().splitlines(keepends=True):
+            fields = line.split(b" ")
+            if len(fields) > 4 and fields[4] == fullpath.encode():
+                f.seek(offset)
+                f.write(b" " * (len(line) - 1) + b"\n")
+            elif line.strip():
+                mounted = True
+            offset += len(line)
+        if not mounted:
+            f.truncate(0)
+
+
+def failed() -> bool:
+    return random.random() < failure_rate
+
+
+def write_output(name: str):
+    for i in range(output_lines):
+        print(f"{name}: startup output line {i}", file=sys.stderr, flush=True)
+
+
+def serve_mount(fullpath: str, fstype: str):
+    """A long running mount process, unmounts itself when terminated."""
+    time.sleep(startup_delay)
+    write_output(fstype)
+    if failed():
+        print("Fatal error: simulated failure", file=sys.stderr, flush=True)
+        sys.exit(1)
+    add_mount(fullpath, fstype)
+
+    def stop(*args):
+        remove_mount(fullpath)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        signal.pause()
+
+
+def rcd(args: list):
+    """The rclone remote control daemon, with the methods rcd.py uses and
+    basic auth with the credentials of RCLONE_RC_USER and RCLONE_RC_PASS."""
+    address = next(a for a in args if a.startswith("--rc-addr=")).split("=", 1)[1]
+    host, port = address.rsplit(":", 1)
+    credentials = f"{os.environ['RCLONE_RC_USER']}:{os.environ['RCLONE_RC_PASS']}"
+    authorization = f"Basic {base64.b64encode(credentials.encode()).decode()}"
+    remotes = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+            method = self.path.strip("/")
+            status, output = 200, {}
+            if self.headers.get("Authorization") != authorization:
+                status, output = 401, {"error": "unauthorized"}
+            elif method == "config/create":
+                with lock:
+                    remotes[params["name"]] = params
+            elif method == "config/delete":
+                with lock:
+                    remotes.pop(params["name"], None)
+            elif method == "operations/list":
+                time.sleep(check_delay)
+                if params["fs"].rstrip(":") not in remotes:
+                    status, output = 500, {"error": "didn't find section in config"}
+                else:
+                    output = {"list": []}
+            elif method == "mount/mount":
+                time.sleep(startup_delay)
+                if failed():
+                    status, output = 500, {"error": "simulated failure"}
+                else:
+                    add_mount(params["mountPoint"], "fuse.rclone")
+            elif method == "mount/unmount":
+                time.sleep(unmount_delay)
+                remove_mount(params["mountPoint"])
+            data = json.dumps(output).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    ThreadingHTTPServer((host, int(port)), Handler).serve_forever()
+
+
+def rclone(args: list):
+    command = args[0]
+    if command == "obscure":
+        print(f"fake-obscured-{args[1]}")
+    elif command == "lsd":
+        time.sleep(check_delay)
+    elif command == "mount":
+        # rclone mount [--config file] remote:path mountpoint [flags]
+        positional = [a for a in args[1:] if not a.startswith("-")]
+        if "--config" in args:
+            positional.remove(args[args.index("--config") + 1])
+        serve_mount(os.path.normpath(positional[1]), "fuse.rclone")
+    elif command == "rcd":
+        rcd(args[1:])
+    else:
+        sys.exit(f"fake rclone: unsupported command {command}")
+
+
+def umount(args: list):
+    time.sleep(unmount_delay)
+    remove_mount(os.path.normpath(args[-1]))
+
+
+def mount_nfs4(args: list):
+    # One-shot helper, exits once mounted
+    time.sleep(startup_delay)
+    if failed():
+        sys.exit("mount.nfs4: simulated failure")
+    add_mount(os.path.normpath(args[-1]), "nfs4")
+
+
+def fusedriver(args: list):
+    serve_mount(os.path.normpath(args[-1]), "fuse.unicore")
+
+
+commands = {
+    "rclone": rclone,
+    "umount": umount,
+    "mount.nfs4": mount_nfs4,
+    "unicore-fusedriver": fusedriver,
+}
+
+if __name__ == "__main__":
+    commands[os.path.basename(sys.argv[0])](sys.argv[1:])
@@ -0,0 +1,48 @@
+import asyncio
+import os
+import time
+
+import config_watch
+
+
+def test_reload_logging_off_the_event_loop(monkeypatch):
+    # Stopping the listener waits for a slow handler
+    monkeypatch.setattr(config_watch, "createLogger", lambda: time.sleep(0.5))
+
+    async def run():
+        reload = asyncio.create_task(
+            config_watch.apply(config_watch.logging_config_path)
+        )
+        ticks = 0
+        while not reload.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert ticks > 10
+
+    asyncio.run(run())
+
+
+def test_missing_directory(monkeypatch, tmp_path):
+    """A config file in a directory created after the start is noticed."""
+    path = tmp_path / "config" / "mounts.json"
+    reloaded = []
+    monkeypatch.setattr(
+        config_watch, "reloads", {str(path): lambda: reloaded.append(1)}
+    )
+    monkeypatch.setattr(config_watch, "debounce", 0.05)
+
+    async def run():
+        task = asyncio.create_task(config_watch.watch())
+        await asyncio.sleep(0.1)
+        os.makedirs(path.parent)
+        await asyncio.sleep(0.2)
+        path.write_text("[]")
+        for _ in range(50):
+            if reloaded:
+                break
+            await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert reloaded
+
+    asyncio.run(run())
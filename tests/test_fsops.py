@@ -0,0 +1,28 @@
+import asyncio
+import threading
+
+import fsops
+import pytest
+
+
+def test_hung_mountpoints_leave_the_pool(monkeypatch):
+    """More hung mountpoints than threads don't use up the pool."""
+    monkeypatch.setattr(fsops, "pool", fsops.Pool(2))
+    hung = threading.Event()
+
+    async def run():
+        for i in range(4):
+            with pytest.raises(fsops.MountpointHung, match="not responding"):
+                await fsops.run(f"/hung{i}", hung.wait, timeout=0.1)
+        with pytest.raises(fsops.MountpointHung, match="quarantined"):
+            await fsops.run("/hung0", hung.wait)
+        assert await fsops.run("/fine", lambda: 42, timeout=1) == 42
+        assert fsops.pool.threads == 1
+
+        hung.set()
+        # The stuck threads exit instead of returning to the pool
+        while fsops.quarantined or fsops.pool.detached:
+            await asyncio.sleep(0.01)
+        assert fsops.pool.threads == 1
+
+    asyncio.run(run())
@@ -0,0 +1,37 @@
+import asyncio
+
+import health
+import registry
+
+
+def test_unmount_cancels_remount(api, mount_body):
+    async def run():
+        async with api() as client:
+            response = await client.post("/", json=mount_body("dead"))
+            assert response.status_code == 204, response.text
+            await health.probe("dead")
+            task = asyncio.create_task(asyncio.sleep(60))
+            health.remount_tasks["dead"] = task
+
+            response = await client.delete("/dead")
+            assert response.status_code == 204, response.text
+            assert "dead" not in health.states
+            assert "dead" not in health.remount_tasks
+            await asyncio.gather(task, return_exceptions=True)
+            assert task.cancelled()
+
+    asyncio.run(run())
+
+
+def test_remount_of_unmounted_path(api, mount_body):
+    """A remount due before the path was unmounted doesn't mount it again."""
+
+    async def run():
+        async with api() as client:
+            health.states["gone"] = health.new_state()
+            await health.remount("gone", mount_body("gone"))
+            assert await registry.get("gone") is None
+            assert health.states["gone"]["pending"] is None
+            health.states.pop("gone")
+
+    asyncio.run(run())
@@ -0,0 +1,25 @@
+import asyncio
+import os
+
+import journal
+import output
+
+
+def test_log_file_truncated(api, mount_body, monkeypatch):
+    monkeypatch.setattr(journal, "mount_journal", True)
+    monkeypatch.setattr(output, "log_file_max_size", 4096)
+    monkeypatch.setenv("FAKE_OUTPUT_LINES", "1000")
+
+    async def run():
+        async with api() as client:
+            response = await client.post("/", json=mount_body("chatty"))
+            assert response.status_code == 204, response.text
+            await asyncio.sleep(2 * output.log_file_poll_interval)
+            assert os.path.getsize(journal.log_file("chatty")) <= 4096
+            response = await client.get("/chatty/logs")
+            assert response.status_code == 200, response.text
+            # Detached mounts are left running at shutdown
+            response = await client.delete("/chatty")
+            assert response.status_code == 204, response.text
+
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+
+import mountinfo
+import registry
+import utils
+from models import DataMountModel
+
+
+def test_concurrent_mounts(api, mount_body, monkeypatch):
+    """Mounts to distinct paths don't wait for each other."""
+    monkeypatch.setenv("FAKE_STARTUP_DELAY", "1")
+
+    async def mount(client, path):
+        response = await client.post("/", json=mount_body(path))
+        assert response.status_code == 204, response.text
+
+    async def run():
+        async with api() as client:
+            start = time.perf_counter()
+            await mount(client, "single")
+            single = time.perf_counter() - start
+
+            start = time.perf_counter()
+            await asyncio.gather(*(mount(client, f"path{i}") for i in range(8)))
+            elapsed = time.perf_counter() - start
+            assert elapsed < 2 * single, f"8 mounts: {elapsed:.2f}s, 1: {single:.2f}s"
+
+            response = await client.get("/")
+            assert len(response.json()) == 9
+            # Locks of idle paths are dropped
+            assert registry.path_locks == {}
+
+    asyncio.run(run())
+
+
+def test_metric_labels(api, mount_body):
+    """Unknown templates and backend types don't create label values,
+    neither do paths."""
+    body = mount_body("custom")
+    body["options"]["template"] = "my-s3"
+    body["options"]["config"]["type"] = "s3"
+
+    async def run():
+        async with api() as client:
+            response = await client.post("/", json=body)
+            assert response.status_code == 204, response.text
+            response = await client.get("/metrics")
+            assert 'template="other",type="s3"' in response.text
+            assert "my-s3" not in response.text
+            assert (
+                'datamount_mount_process_rss_bytes{backend="process",template="other"}'
+                in response.text
+            )
+            assert 'path="' not in response.text
+
+    asyncio.run(run())
+
+
+def test_reserved_path(api, mount_body):
+    async def run():
+        async with api() as client:
+            response = await client.post("/", json=mount_body("batch"))
+            assert response.status_code == 400, response.text
+
+    asyncio.run(run())
+
+
+def processes_with(argument: str) -> list:
+    pids = []
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                if argument.encode() in f.read().split(b"\0"):
+                    pids.append(pid)
+        except OSError:
+            pass
+    return pids
+
+
+def test_cancelled_mount(api, mount_body, monkeypatch):
+    """A mount cancelled while its process starts leaves nothing behind."""
+    monkeypatch.setenv("FAKE_STARTUP_DELAY", "1.5")
+    item = DataMountModel(**mount_body("cancelled"))
+    fullpath = os.path.join(utils.base_mount_dir, "cancelled")
+
+    async def run():
+        async with api() as client:
+            try:
+                await asyncio.wait_for(utils.mount(item), 0.7)
+            except asyncio.TimeoutError:
+                pass
+            assert processes_with(fullpath) == []
+            # Past the startup delay of a process that would still run
+            await asyncio.sleep(1.2)
+            assert not mountinfo.is_mounted(fullpath)
+            assert "cancelled" not in utils.mounts
+            response = await client.get("/")
+            assert "cancelled" not in response.json()
+
+    asyncio.run(run())
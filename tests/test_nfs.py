@@ -0,0 +1,75 @@
+import asyncio
+
+import nfs
+import nfs_policy
+import pytest
+from models import DataMountModel
+
+
+@pytest.mark.parametrize(
+    "entry", ["10.0.0.0/33", "10.0.0.256", "fd00::/129", "nfs server", "-nfs.org"]
+)
+def test_invalid_entries(entry):
+    with pytest.raises(Exception, match="NFS_BLOCKED_MOUNTS"):
+        nfs_policy.Policy(["10.0.0.0/8", entry], [])
+
+
+def test_policy():
+    policy = nfs_policy.Policy(
+        ["10.0.0.0/8", "10.1.2.3", "fd00::/8", "Blocked.Example.org."], []
+    )
+    assert policy.forbidden("10.20.30.40")
+    assert policy.forbidden("::ffff:10.0.0.1")
+    assert policy.forbidden("blocked.example.org")
+    assert not policy.forbidden("192.168.0.1")
+    assert not policy.forbidden("fe80::1")
+    assert not policy.forbidden("nfs.example.org")
+
+
+def cmd(server: str) -> list:
+    item = DataMountModel(
+        path="nfs",
+        options={
+            "displayName": "nfs",
+            "template": "nfs",
+            "config": {"server": server, "remotepath": "/export"},
+        },
+    )
+    return asyncio.run(nfs.cmd(item))
+
+
+@pytest.mark.parametrize(
+    "server,source",
+    [("127.0.0.1", "127.0.0.1:/export"), ("::1", "[::1]:/export")],
+)
+def test_mount_source(server, source):
+    assert cmd(server)[-2] == source
+
+
+def test_mount_source_name():
+    """Names are kept for Kerberos."""
+    assert cmd("localhost")[-2] == "localhost:/export"
+
+
+def test_mount_source_pinned(monkeypatch):
+    """A name is mounted by the address it was checked with."""
+    monkeypatch.setattr(nfs, "nfs_pin_address", True)
+    source = cmd("localhost")[-2]
+    assert source in ["127.0.0.1:/export", "[::1]:/export"]
+
+
+def test_load(monkeypatch):
+    """The lists are read from the environment on every load."""
+    monkeypatch.setattr(nfs_policy, "policy", nfs_policy.policy)
+    monkeypatch.setenv("NFS_BLOCKED_MOUNTS", "127.0.0.0/8, blocked.example.org")
+    nfs_policy.load()
+    assert nfs_policy.forbidden("127.0.0.1")
+    assert nfs_policy.forbidden("blocked.example.org")
+    assert not nfs_policy.forbidden("10.0.0.1")
+
+
+def test_resolved_address_forbidden(monkeypatch):
+    policy = nfs_policy.Policy(["127.0.0.0/8", "::1"], [])
+    monkeypatch.setattr(nfs_policy, "policy", policy)
+    with pytest.raises(Exception, match="forbidden"):
+        cmd("localhost")
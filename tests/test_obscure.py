@@ -0,0 +1,27 @@
+import obscure
+import pytest
+
+
+# Test vectors of rclone's fs/config/obscure/obscure_test.go
+@pytest.mark.parametrize(
+    "value,iv,expected",
+    [
+        ("", b"a" * 16, "YWFhYWFhYWFhYWFhYWFhYQ"),
+        ("potato", b"a" * 16, "YWFhYWFhYWFhYWFhYWFhYXMaGgIlEQ"),
+        ("potato", b"b" * 16, "YmJiYmJiYmJiYmJiYmJiYp3gcEWbAw"),
+    ],
+)
+def test_obscure(value, iv, expected):
+    assert obscure.obscure(value, iv) == expected
+    assert obscure.reveal(expected) == value
+
+
+def test_reveal_round_trip():
+    value = "a longer secret spanning several AES blocks, with ünïcode"
+    assert obscure.reveal(obscure.obscure(value)) == value
+    assert obscure.obscure(value) != obscure.obscure(value)
+
+
+def test_reveal_too_short():
+    with pytest.raises(ValueError):
+        obscure.reveal("YWFh")
@@ -0,0 +1,48 @@
+import asyncio
+import os
+import socket
+
+import mountinfo
+import pytest
+import rcd
+from values import base_mount_dir
+
+
+@pytest.fixture
+def rcd_backend(monkeypatch):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    monkeypatch.setattr(rcd, "enabled", True)
+    monkeypatch.setattr(rcd, "rc_addr", f"127.0.0.1:{port}")
+
+
+def test_mount_unmount(rcd_backend, api, mount_body):
+    fullpath = os.path.join(base_mount_dir, "rcd")
+
+    async def run():
+        async with api() as client:
+            assert rcd.process is not None
+            # The credentials are passed in the environment
+            with open(f"/proc/{rcd.process.pid}/cmdline", "rb") as f:
+                assert b"--rc-pass" not in f.read()
+            response = await client.post("/", json=mount_body("rcd"))
+            assert response.status_code == 204, response.text
+            assert fullpath in mountinfo.get_mountpoints()
+            response = await client.get("/")
+            assert [m["path"] for m in response.json()] == ["rcd"]
+
+            response = await client.delete("/rcd")
+            assert response.status_code == 204, response.text
+            assert fullpath not in mountinfo.get_mountpoints()
+            # The entry is dropped once the mount is gone from the table
+            for _ in range(50):
+                response = await client.get("/")
+                if response.json() == []:
+                    break
+                await asyncio.sleep(0.1)
+            else:
+                pytest.fail(f"Still listed after unmount: {response.text}")
+        assert rcd.process is None
+
+    asyncio.run(run())
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import sqlite3
+
+import main
+import pytest
+import registry
+
+
+@pytest.fixture
+def shared(monkeypatch, tmp_path):
+    monkeypatch.setattr(registry, "shared_registry", True)
+    monkeypatch.setattr(registry, "registry_path", str(tmp_path / "registry.sqlite3"))
+    monkeypatch.setattr(registry, "connection", None)
+    yield
+    registry.db_thread().submit(lambda: registry.connection.close()).result()
+    registry.connection = None
+
+
+def test_shared_registry(shared):
+    async def run():
+        await registry.add("a", {"pid": 1})
+        assert await registry.get("a") == {"pid": 1, "owner": os.getpid()}
+        assert await registry.owns("a", 1)
+        assert not await registry.claim("a", 0)
+        await registry.remove("a", 0)
+        assert list(await registry.all()) == ["a"]
+        await registry.remove("a")
+        assert await registry.get("a") is None
+
+        registry.save_job({"id": "job", "status": "queued"})
+        assert await registry.get_job("job") == {"id": "job", "status": "queued"}
+
+    asyncio.run(run())
+
+
+def test_shared_registry_not_blocking(shared):
+    """A locked database is waited for on the registry thread."""
+
+    async def run():
+        await registry.get("a")
+        # Another worker writing
+        other = sqlite3.connect(registry.registry_path, isolation_level=None)
+        other.execute("BEGIN EXCLUSIVE")
+        blocked = asyncio.create_task(registry.add("a", {"pid": 1}))
+        ticks = 0
+        while not blocked.done() and ticks < 10:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert ticks == 10
+        other.execute("ROLLBACK")
+        other.close()
+        await blocked
+        assert await registry.get("a") is not None
+
+    asyncio.run(run())
+
+
+def test_workers_require_shared_registry(monkeypatch):
+    monkeypatch.setattr(main, "gunicorn_workers", 2)
+
+    async def run():
+        with pytest.raises(Exception, match="SHARED_REGISTRY"):
+            async with main.app.router.lifespan_context(main.app):
+                pass
+
+    asyncio.run(run())
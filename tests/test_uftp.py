@@ -0,0 +1,92 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+import uftp
+
+
+@pytest.fixture
+def auth_server():
+    """Stub of the UNICORE authentication server, records the requests."""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            requests.append(json.loads(body))
+            data = json.dumps(
+                {"serverHost": "127.0.0.1", "serverPort": 64434, "secret": "x"}
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/rest/auth/UFTP", requests
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def uftp_calls(monkeypatch):
+    """Counts the calls of uftp.authenticate and uftp.forget."""
+    calls = {"authenticate": 0, "forget": 0}
+    for name in calls:
+        function = getattr(uftp, name)
+
+        def counted(*args, name=name, function=function):
+            calls[name] += 1
+            return function(*args)
+
+        monkeypatch.setattr(uftp, name, counted)
+    monkeypatch.setattr(uftp, "fusedriver", "unicore-fusedriver")
+    uftp.auth_cache.clear()
+    return calls
+
+
+def uftp_body(path: str, auth_url: str, access_token: str = "token") -> dict:
+    config = {"access_token": access_token, "auth_url": auth_url, "remotepath": "/"}
+    return {
+        "path": path,
+        "options": {"displayName": path, "template": "uftp", "config": config},
+    }
+
+
+def test_authentication_cached(api, auth_server, uftp_calls):
+    auth_url, requests = auth_server
+
+    async def run():
+        async with api() as client:
+            for path in ["uftp1", "uftp2"]:
+                response = await client.post("/", json=uftp_body(path, auth_url))
+                assert response.status_code == 204, response.text
+
+    asyncio.run(run())
+    assert uftp_calls == {"authenticate": 1, "forget": 0}
+    assert len(requests) == 1
+    assert len(uftp.auth_cache) == 1
+
+
+def test_authentication_forgotten_on_failure(api, auth_server, uftp_calls, monkeypatch):
+    auth_url, requests = auth_server
+    monkeypatch.setenv("FAKE_FAILURE_RATE", "1")
+
+    async def run():
+        async with api() as client:
+            response = await client.post("/", json=uftp_body("uftp", auth_url))
+            assert response.status_code == 400, response.text
+
+    asyncio.run(run())
+    assert uftp_calls == {"authenticate": 1, "forget": 1}
+    assert len(uftp.auth_cache) == 0
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+import vfs_cache
+from models import DataMountModel
+from pydantic import ValidationError
+
+G = vfs_cache.suffixes["G"]
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(vfs_cache, "total_size", 10 * G)
+    monkeypatch.setattr(vfs_cache, "min_size", 1 * G)
+    monkeypatch.setattr(vfs_cache, "expected_mounts", 1)
+    monkeypatch.setattr(vfs_cache, "allocations", {})
+
+
+def test_exhausted_budget(budget):
+    """With less than the minimum size left, mounts are refused instead
+    of getting the minimum size on top of the total."""
+    vfs_cache.allocations["big"] = {"weight": 1.0, "size": 9 * G + G // 2}
+
+    async def run():
+        with pytest.raises(Exception, match="budget exhausted"):
+            await vfs_cache.allocate("small")
+        assert "small" not in vfs_cache.allocations
+
+    asyncio.run(run())
+
+
+def test_minimum_size_within_budget(budget, monkeypatch):
+    monkeypatch.setattr(vfs_cache, "expected_mounts", 100)
+
+    async def run():
+        # The fair share is 100M, the minimum still fits
+        assert await vfs_cache.allocate("small") == vfs_cache.min_size
+
+    asyncio.run(run())
+
+
+def test_cache_weight_positive(mount_body):
+    body = mount_body("weighted")
+    body["options"]["cache_weight"] = 0
+    with pytest.raises(ValidationError):
+        DataMountModel(**body)
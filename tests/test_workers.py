@@ -0,0 +1,146 @@
+"""Runs gunicorn with two workers sharing the registry, see
+gunicorn_http.py. Connections are kept open, so every client talks to
+one worker, which the owner of its first mount in the registry tells."""
+import asyncio
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import time
+
+import httpx
+import pytest
+from conftest import here
+from conftest import project_dir
+
+repo_dir = os.path.dirname(here)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def server(tmp_path):
+    port = free_port()
+    open(tmp_path / "mountinfo", "w").close()
+    os.makedirs(tmp_path / "mounts")
+    env = {
+        **os.environ,
+        "PYTHONPATH": project_dir,
+        "BASE_DIR": str(tmp_path / "mounts"),
+        "MOUNTINFO_FILE": str(tmp_path / "mountinfo"),
+        "RCLONE_CONFIG_DIR": str(tmp_path / "config"),
+        "INIT_MOUNTS": str(tmp_path / "mounts.json"),
+        "VFS_CACHE_DIR": str(tmp_path / "vfs"),
+        "SHARED_REGISTRY": "true",
+        "SHARED_REGISTRY_FILE": str(tmp_path / "registry.sqlite3"),
+        "GUNICORN_WORKERS": "2",
+        "FAKE_STARTUP_DELAY": "0.5",
+    }
+    log = open(tmp_path / "gunicorn.log", "w")
+    process = subprocess.Popen(
+        [
+            "gunicorn",
+            "-c",
+            os.path.join(repo_dir, "gunicorn_http.py"),
+            "-b",
+            f"127.0.0.1:{port}",
+            "--pid",
+            str(tmp_path / "gunicorn.pid"),
+            "--user",
+            str(os.getuid()),
+            "--group",
+            str(os.getgid()),
+            "--keep-alive",
+            "60",
+            "main:app",
+        ],
+        cwd=project_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=log,
+    )
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/ready").status_code == 200:
+                break
+        except httpx.TransportError:
+            pass
+        assert process.poll() is None, (tmp_path / "gunicorn.log").read_text()
+        assert time.monotonic() < deadline, "gunicorn did not start"
+        time.sleep(0.1)
+    yield f"http://127.0.0.1:{port}", tmp_path
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=60)
+    log.close()
+
+
+def owner(registry_path: str, path: str):
+    with sqlite3.connect(registry_path) as connection:
+        row = connection.execute(
+            "SELECT owner FROM mounts WHERE path = ?", (path,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def test_workers(server, mount_body):
+    url, tmp_path = server
+    registry_path = str(tmp_path / "registry.sqlite3")
+
+    async def run():
+        # One connection per client, pick clients of two workers
+        probes = []
+        clients = {}
+        while len(clients) < 2 and len(probes) < 40:
+            batch = [
+                httpx.AsyncClient(
+                    base_url=url,
+                    timeout=30,
+                    limits=httpx.Limits(max_connections=1, keepalive_expiry=60),
+                )
+                for _ in range(8)
+            ]
+            paths = [f"probe{len(probes) + i}" for i in range(len(batch))]
+            probes += batch
+            responses = await asyncio.gather(
+                *(c.post("/", json=mount_body(p)) for c, p in zip(batch, paths))
+            )
+            assert all(r.status_code == 204 for r in responses)
+            for client, path in zip(batch, paths):
+                clients.setdefault(owner(registry_path, path), client)
+        assert len(clients) == 2, "all connections went to one worker"
+        (first_pid, first), (_, second) = clients.items()
+
+        response = await first.post("/", json=mount_body("shared"))
+        assert response.status_code == 204, response.text
+        assert owner(registry_path, "shared") == first_pid
+        response = await second.get("/")
+        assert "shared" in [mount["path"] for mount in response.json()]
+        response = await second.delete("/shared")
+        assert response.status_code == 204, response.text
+        response = await first.get("/")
+        assert "shared" not in [mount["path"] for mount in response.json()]
+        assert "/shared " not in (tmp_path / "mountinfo").read_text()
+
+        # The path lock serializes mounts across workers, the later one
+        # finds the path mounted
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            first.post("/", json=mount_body("race")),
+            second.post("/", json=mount_body("race")),
+        )
+        elapsed = time.perf_counter() - start
+        assert sorted(r.status_code for r in responses) == [204, 400]
+        assert any("already mounted" in r.text for r in responses)
+        assert elapsed >= 0.5
+        assert (tmp_path / "mountinfo").read_text().count("/race ") == 1
+
+        for client in probes:
+            await client.aclose()
+
+    asyncio.run(run())